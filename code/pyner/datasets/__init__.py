@@ -8,6 +8,12 @@ import sys
 
 ner_tags = ['PARK', 'CHAR', 'ATTR', 'REST', 'ENTE', 'RESO', 'PLAC']
 
+# Adding re.UNICODE with \s gets rid of some stupid special unicode whitespaces
+# That's neccessary, because otherwise the stanford POS tagger will split words at
+# these whitespaces and then the POS sequences have different lengths from the
+# token sequences
+_WHITESPACE_RUNS = re.compile(r"[\t\s]+", flags=re.UNICODE)
+
 def split_to_chunks(of_list, chunk_size):
     """Splits a list to smaller chunks.
     Args:
@@ -43,7 +49,7 @@ def load_articles(filepath, start_at=0):
                     yield Article(article)
 
 def load_windows(articles, window_size, features=None, every_nth_window=1,
-                 only_labeled_windows=False):
+                 only_labeled_windows=False, batch_size=100):
     """Loads smaller windows with a maximum size per window from a generator of articles.
     Args:
         articles: Generator of articles, as provided by load_articles().
@@ -55,9 +61,18 @@ def load_windows(articles, window_size, features=None, every_nth_window=1,
             (different) articles. (Default is 1, return every window.)
         only_labeled_windows: If set to True, the function will only return windows that contain
             at least one labeled token (at leas one named entity). (Default is False.)
+        batch_size: How many windows to apply the features to at once, see
+            apply_features_to_windows(). (Default is 100.)
     Returns:
         Generator of Window objects, i.e. list of Window objects.
     """
+    windows = _split_to_windows(articles, window_size, every_nth_window, only_labeled_windows)
+    if features is not None:
+        windows = apply_features_in_batches(windows, features, batch_size)
+    return windows
+
+def _split_to_windows(articles, window_size, every_nth_window, only_labeled_windows):
+    """Generator of the windows of load_windows(), without features."""
     processed_windows = 0
     for article in articles:
         # count how many labels there are in the article
@@ -76,12 +91,60 @@ def load_windows(articles, window_size, features=None, every_nth_window=1,
                 # ignore the window if it contains no labels and that was requested via parameters
                 if not only_labeled_windows or window.count_labels() > 0:
                     if processed_windows % every_nth_window == 0:
-                        # generate features for all tokens in the window
-                        if features is not None:
-                            window.apply_features(features)
                         yield window
                     processed_windows += 1
 
+def apply_features_in_batches(windows, features, batch_size=100):
+    """Applies a list of feature generators to windows as they are generated, batch_size windows
+    at a time, see apply_features_to_windows().
+    Args:
+        windows: Generator of Window objects.
+        features: A list of feature generators from features.py .
+        batch_size: How many windows to apply the features to at once. (Default is 100.)
+    Returns:
+        Generator of the Window objects, with their features.
+    """
+    # windows waiting for their features
+    batch = []
+    for window in windows:
+        batch.append(window)
+        if len(batch) >= batch_size:
+            apply_features_to_windows(batch, features)
+            for batch_window in batch:
+                yield batch_window
+            batch = []
+
+    if batch:
+        apply_features_to_windows(batch, features)
+        for batch_window in batch:
+            yield batch_window
+
+def apply_features_to_windows(windows, features):
+    """Applies a list of feature generators to the tokens of several windows, like
+    Window.apply_features() does for one window.
+    The feature generators that have a convert_windows() method get all the windows in a single
+    call, which lets them batch their work (e.g. POS-tag all the windows with one call to the
+    tagger). The other ones convert the windows one by one with convert_window().
+    Args:
+        windows: List of Window objects.
+        features: A list of feature generators from features.py .
+    """
+    # feature_values is a multi-dimensional list
+    # 1st dimension: Feature (class)
+    # 2nd dimension: window
+    # 3rd dimension: token
+    # 4th dimension: values (for this token and feature)
+    features_values = []
+    for feature in features:
+        if hasattr(feature, "convert_windows"):
+            features_values.append(feature.convert_windows(windows))
+        else:
+            features_values.append([feature.convert_window(window) for window in windows])
+
+    for window_idx, window in enumerate(windows):
+        window.set_feature_values([feature_values[window_idx]
+                                   for feature_values in features_values])
+
 def generate_examples(windows, skip_chain_left, skip_chain_right, nb_append=None, nb_skip=0, verbose=True):
     """Generates example pairs of feature lists (one per token) and labels.
     Args:
@@ -106,11 +169,8 @@ def generate_examples(windows, skip_chain_left, skip_chain_right, nb_append=None
             # chain of labels (list of strings)
             labels = window.get_labels()
             # chain of features (list of lists of strings)
-            feature_values_lists = []
-            for word_idx in range(len(window.tokens)):
-                fvl = window.get_feature_values_list(word_idx,
-                                                     skip_chain_left, skip_chain_right)
-                feature_values_lists.append(fvl)
+            feature_values_lists = window.get_feature_values_lists(skip_chain_left,
+                                                                   skip_chain_right)
             # yield (features, labels) pair
             yield (feature_values_lists, labels)
 
@@ -157,11 +217,7 @@ class Article(object):
         Args:
             text: The string content of the article/document.
         """
-        # Adding re.UNICODE with \s gets rid of some stupid special unicode whitespaces
-        # That's neccessary, because otherwise the stanford POS tagger will split words at
-        # these whitespaces and then the POS sequences have different lengths from the
-        # token sequences
-        text = re.sub(r"[\t\s]+", " ", text, flags=re.UNICODE)
+        text = _WHITESPACE_RUNS.sub(" ", text)
         tokens_str = [token_str.strip() for token_str in text.strip().split(" ")]
         self.tokens = [Token(token_str) for token_str in tokens_str if len(token_str) > 0]
         self.no_ne_label = no_ne_label
@@ -209,6 +265,8 @@ class Window(Article):
         """
         super(Window, self).__init__("") # because pylint complains otherwise
         self.tokens = tokens
+        # ngram size -> phrases of the ngrams, see get_ngram_phrases()
+        self._ngram_phrases = {}
 
     def apply_features(self, features):
         """Applies a list of feature generators to the tokens of this window.
@@ -224,8 +282,14 @@ class Window(Article):
         # 2nd dimension: token
         # 3rd dimension: values (for this token and feature, usually just one value, sometimes more,
         #                        e.g. "w2vc=975")
-        features_values = [feature.convert_window(self) for feature in features]
+        self.set_feature_values([feature.convert_window(self) for feature in features])
 
+    def set_feature_values(self, features_values):
+        """Saves the feature values generated for this window in its tokens.
+        Args:
+            features_values: List with, for each feature generator, the list of lists of feature
+                values it generated for the window (one list per token).
+        """
         for token in self.tokens:
             token.feature_values = []
 
@@ -257,13 +321,54 @@ class Window(Article):
         start = max(0, word_index - skipchain_left)
         end = min(len(self.tokens), word_index + 1 + skipchain_right)
         for i, token in enumerate(self.tokens[start:end]):
-            diff = start + i - word_index
-            feature_values = ["%d:%s" % (diff, feature_value) \
-                              for feature_value in token.feature_values]
-            all_feature_values.extend(feature_values)
+            # the offset prefix is formatted once per token, not once per feature value
+            prefix = "%d:" % (start + i - word_index)
+            all_feature_values.extend([prefix + feature_value
+                                       for feature_value in token.feature_values])
 
         return all_feature_values
 
+    def get_feature_values_lists(self, skipchain_left, skipchain_right):
+        """Generates the lists of feature values of all the tokens/words in the window, i.e.
+        [self.get_feature_values_list(i, skipchain_left, skipchain_right) for i in ...], with
+        the offset prefixes ("-1:", "0:", ...) formatted once for the whole window.
+        Args:
+            skipchain_left: See get_feature_values_list().
+            skipchain_right: See get_feature_values_list().
+        Returns:
+            List of lists of strings (one list of feature values per token).
+        """
+        prefixes = ["%d:" % diff for diff in range(-skipchain_left, skipchain_right + 1)]
+        tokens = self.tokens
+        feature_values_lists = []
+        for word_index in range(len(tokens)):
+            all_feature_values = []
+            start = max(0, word_index - skipchain_left)
+            end = min(len(tokens), word_index + 1 + skipchain_right)
+            for i in range(start, end):
+                prefix = prefixes[i - word_index + skipchain_left]
+                all_feature_values.extend([prefix + feature_value
+                                           for feature_value in tokens[i].feature_values])
+            feature_values_lists.append(all_feature_values)
+        return feature_values_lists
+
+    def get_ngram_phrases(self, ngram):
+        """Returns the phrases of the ngrams of the window, i.e. the words of each run of ngram
+        consecutive tokens joined by whitespaces, in the order of their first token. There are
+        no ngrams for the last ngram-1 tokens. The phrases are built once per window and size,
+        all the ngram feature generators share them.
+        Args:
+            ngram: The number of tokens in the ngrams.
+        Returns:
+            List of strings.
+        """
+        phrases = self._ngram_phrases.get(ngram)
+        if phrases is None:
+            words = [token.word for token in self.tokens]
+            phrases = [" ".join(words[i:i + ngram]) for i in range(len(words) - ngram + 1)]
+            self._ngram_phrases[ngram] = phrases
+        return phrases
+
     def get_labels(self):
         """Returns the labels of all tokens as a list.
         Returns:
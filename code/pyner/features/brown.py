@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Wrapper for a file containing brown clusters of a corpus."""
 from __future__ import absolute_import, division, print_function, unicode_literals
+import io
 
 class BrownClusters(object):
     """
@@ -43,12 +44,15 @@ class BrownClusters(object):
         Args:
             filepath: The filepath to the file 'paths' file containing the brown clusters.
         """
-        with open(filepath, "r") as handle:
+        # bitchain -> the first string read for it, so that all the words of a cluster share
+        # one bitchain string instead of keeping a copy each
+        bitchains = dict()
+        with io.open(filepath, "r", encoding="utf-8") as handle:
             last_count = -1
             cluster_idx = 1
 
             for line_idx, line in enumerate(handle):
-                columns = line.decode("utf-8").strip().split("\t")
+                columns = line.strip().split("\t")
                 if len(columns) == 3:
                     bitchain, word, count = columns
                     count = int(count)
@@ -58,7 +62,7 @@ class BrownClusters(object):
                     last_count = count
 
                     self.word_to_cluster[word] = cluster_idx
-                    self.word_to_bitchain[word] = bitchain
+                    self.word_to_bitchain[word] = bitchains.setdefault(bitchain, bitchain)
                 else:
                     print("[Warning] Expected 3 columns in brown clusters file at line %d, " \
                           "got %d" % (line_idx, len(columns)))
@@ -6,8 +6,89 @@ Contains:
     2. A method to create all feature generators.
 """
 from __future__ import absolute_import, division, print_function, unicode_literals
-import re
 from collections import OrderedDict
+import heapq
+import re
+import sys
+from timeit import default_timer
+try:
+    from sys import intern
+except ImportError:
+    # Python 2 only interns byte strings; the feature strings are still shared through the
+    # tables below
+    def intern(string):
+        return string
+
+# The characters tested by the digits and punctuation features
+_DIGITS = frozenset("0123456789")
+_PUNCTUATION = frozenset(".,:;()[]?!")
+
+# The values of the boolean features, interned (indexed by the boolean) so that all
+# tokens share the same string objects
+_STARTS_WITH_UPPERCASE = (intern("swu=0"), intern("swu=1"))
+_CONTAINS_DIGITS = (intern("cD=0"), intern("cD=1"))
+_CONTAINS_PUNCTUATION = (intern("cP=0"), intern("cP=1"))
+_ONLY_DIGITS = (intern("oD=0"), intern("oD=1"))
+_ONLY_PUNCTUATION = (intern("oP=0"), intern("oP=1"))
+
+class _TranslationTable(dict):
+    """Translation table (for str.translate) mapping the code points of the characters in a
+    dict to other characters, and any character not in the dict to a default character."""
+    def __init__(self, mapping, default):
+        """Creates the table.
+        Args:
+            mapping: List of tuples (characters, character to map all of them to).
+            default: The character to map the other characters to.
+        """
+        dict.__init__(self, ((ord(from_char), to_char)
+                             for from_chars, to_char in mapping for from_char in from_chars))
+        self.default = default
+
+    def __missing__(self, code):
+        self[code] = self.default
+        return self.default
+
+_UPPERCASE = "ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÜ"
+_LOWERCASE = "abcdefghijklmnopqrstuvwxyzäöüß"
+
+# maps each character to its class in word patterns, "A", "a", "9", "." or "(", else to "#"
+_WORD_PATTERN_TABLE = _TranslationTable([(_UPPERCASE, "A"),
+                                         (_LOWERCASE, "a"),
+                                         ("0123456789", "9"),
+                                         (".!?,;", "."),
+                                         ("()[]{}", "(")], "#")
+
+# runs of two or more equal classes in a word pattern, except for digits
+_CLASS_RUNS = re.compile(r"([^9])\1+")
+
+def _collapse_class_run(match):
+    return match.group(1) + "+"
+
+# keeps the letters and the characters .,!? of prefixes and suffixes, maps the others to "#"
+_AFFIX_TABLE = _TranslationTable([(char, char) for char in _UPPERCASE + _LOWERCASE + ".,!?"],
+                                 "#")
+
+# maps the digits to "9", the punctuation to "." and the other characters to "#", so that the
+# digits and punctuation features of the fused generator come from a single pass over the word
+_CHARACTER_CLASS_TABLE = _TranslationTable([(_DIGITS, "9"), (_PUNCTUATION, ".")], "#")
+
+def _length_features(max_length):
+    """Returns the interned token length features "l=0" to "l=<max_length>", indexed by length."""
+    return tuple(intern("l=%d" % length) for length in range(max_length + 1))
+
+def _word_feature(word_features, word):
+    """Returns the interned word feature of a word, memoized in the dict word_features."""
+    feature = word_features.get(word)
+    if feature is None:
+        feature = word_features[word] = intern("word_feature=%s" % word)
+    return feature
+
+# Plain dicts only keep the insertion order since Python 3.7: the caches evicting their oldest
+# entry need an OrderedDict before
+_InsertionOrderedDict = dict if sys.version_info >= (3, 7) else OrderedDict
+
+# Marks a missing key in Cache.get
+_MISSING = object()
 
 def bucketize_minimum_distance(value):
     return int(value * 20)
@@ -17,7 +98,7 @@ class Cache:
     In process memory cache. Not thread safe
     '''
     def __init__(self, max_size = 100000):
-        self._store = OrderedDict()
+        self._store = _InsertionOrderedDict()
         self._max_size = max_size
 
     def set(self, key, value):
@@ -25,21 +106,68 @@ class Cache:
         self._store[key] = value
     
     def get(self, key, default = None):
-        data = self._store.get(key)
-        if not data:
+        # compares with a sentinel, falsy values such as a distance of 0 are valid cache hits
+        data = self._store.get(key, _MISSING)
+        if data is _MISSING:
             return default
         return data
     
     def _check_limit(self):
+        # the store keeps the insertion order, so this evicts the oldest entry
         if len(self._store) >= self._max_size:
-            self._store.popitem(last = False)
+            del self._store[next(iter(self._store))]
     
     def clear(self):
-        self._store = OrderedDict()
+        self._store = _InsertionOrderedDict()
+
+class WRCache(Cache):
+    '''
+    In process memory cache that knows how long each value took to compute. When full, it
+    evicts the entries that saved the least computation time so far, i.e. with the lowest
+    cost times (1 + hits), instead of the oldest ones: a costly fuzzy search of a rare phrase
+    is kept longer than a cheap lookup of a frequent word. Not thread safe
+    '''
+    def __init__(self, max_size = 100000, evict_fraction = 0.1):
+        Cache.__init__(self, max_size)
+        # entries evicted at once, so that selecting them is amortized over many insertions
+        self._evict_count = max(1, int(max_size * evict_fraction))
+
+    def set(self, key, value, cost = 0.0):
+        self._check_limit()
+        # [value, cost in seconds, number of hits]
+        self._store[key] = [value, cost, 0]
+
+    def get(self, key, default = None):
+        entry = self._store.get(key)
+        if entry is None:
+            return default
+        entry[2] += 1
+        return entry[0]
+
+    def get_or_compute(self, key, compute):
+        '''
+        Returns the value of key, computing it as compute(key) and caching it, with the time
+        this took as cost, if it isn't cached yet.
+        '''
+        entry = self._store.get(key)
+        if entry is not None:
+            entry[2] += 1
+            return entry[0]
+        start = default_timer()
+        value = compute(key)
+        self.set(key, value, default_timer() - start)
+        return value
+
+    def _check_limit(self):
+        if len(self._store) >= self._max_size:
+            evicted = heapq.nsmallest(self._evict_count, self._store.items(),
+                                      key = lambda item: item[1][1] * (1 + item[1][2]))
+            for key, _ in evicted:
+                del self._store[key]
 
 
 from pyner.features.brown import BrownClusters
-from pyner.features.gazetteer import Gazetteer, AllGazetteer
+from pyner.features.gazetteer import load_all_gazetteer
 from pyner.features.lda import LdaWrapper
 from pyner.features.pos import PosTagger
 from pyner.features.w2v import W2VClusters
@@ -70,12 +198,14 @@ def create_features(gazetteers_data, brown_clusters_filepath, w2v_clusters_filep
     # Create the gazetteer. The gazetteer will contain all names from ug_names that have a higher
     # frequency among those names than among all unigrams (from ug_all).
     print_if_verbose("Creating gazetteer...")
-    gazetteers = []
-    for gaz_type, gaz_filepath in gazetteers_data.items():
-        gaz = Gazetteer(gaz_filepath, type = gaz_type)
-        gazetteers.append(gaz)
+    # the gazetteer of each type is only used by the Gazetteer* generators below, enable the
+    # loop (and the import of Gazetteer) with them
+    #gazetteers = []
+    #for gaz_type, gaz_filepath in gazetteers_data.items():
+    #    gaz = Gazetteer(gaz_filepath, type = gaz_type)
+    #    gazetteers.append(gaz)
     
-    allgazetteer = AllGazetteer(gazetteers_data)
+    allgazetteer = load_all_gazetteer(gazetteers_data)
 
     # Load the mapping of word to brown cluster and word to brown cluster bitchain
     #print_if_verbose("Loading brown clusters...")
@@ -96,20 +226,14 @@ def create_features(gazetteers_data, brown_clusters_filepath, w2v_clusters_filep
 
     # create feature generators
     result = [
-        StartsWithUppercaseFeature(),
-        TokenLengthFeature(),
-        ContainsDigitsFeature(),
-        ContainsPunctuationFeature(),
-        OnlyDigitsFeature(),
-        OnlyPunctuationFeature(),
+        # generates the features of StartsWithUppercaseFeature, TokenLengthFeature,
+        # ContainsDigitsFeature, ContainsPunctuationFeature, OnlyDigitsFeature,
+        # OnlyPunctuationFeature, WordPatternFeature, PrefixFeature, SuffixFeature and WordFeature
+        FusedPerTokenFeatures(),
         #W2VClusterFeature(w2vc),
         #BrownClusterFeature(brown),
         #BrownClusterBitsFeature(brown),
-        WordPatternFeature(),
-        PrefixFeature(),
-        SuffixFeature(),
         POSTagFeature(pos),
-        WordFeature(),
         #LDATopicFeature(lda, lda_window_left_size, lda_window_right_size),
         AllGazetteerMinimumDistanceToken(allgazetteer),
         #AllGazetteerMinimumDistanceEntry(allgazetteer),
@@ -141,6 +265,68 @@ def create_features(gazetteers_data, brown_clusters_filepath, w2v_clusters_filep
 
     return result
 
+class FusedPerTokenFeatures(object):
+    """Generates, in a single pass over the tokens, the features that only depend on the token
+    itself: those of StartsWithUppercaseFeature, TokenLengthFeature, ContainsDigitsFeature,
+    ContainsPunctuationFeature, OnlyDigitsFeature, OnlyPunctuationFeature, WordPatternFeature,
+    PrefixFeature, SuffixFeature and WordFeature, in this order."""
+    def __init__(self, max_length=30, max_cache_size=100000):
+        """Instantiates a new object of this feature generator.
+        Args:
+            max_length: The max length to use for the token length feature, see
+                TokenLengthFeature.
+            max_cache_size: How many words to remember the features of. A word appears in many
+                windows, but its features only have to be generated once.
+        """
+        self.max_length = max_length
+        self.length_features = _length_features(max_length)
+        self.word_pattern = WordPatternFeature()
+        self.max_cache_size = max_cache_size
+        # word -> tuple of its features, the oldest word is evicted when it is full
+        self.cache = _InsertionOrderedDict()
+
+    def convert_window(self, window):
+        """Converts a Window object into a list of lists of features, where features are strings.
+        Args:
+            window: The Window object (defined in datasets.py) to use.
+        Returns:
+            List of lists of features.
+            One list of features for each token.
+            Each list can contain any number of features (including 0).
+            Each feature is a string.
+        """
+        cache = self.cache
+        # the tuples of features are never empty
+        return [list(cache.get(token.word) or self._cache_features(token))
+                for token in window.tokens]
+
+    def _cache_features(self, token):
+        features = self.token_to_features(token)
+        if len(self.cache) >= self.max_cache_size:
+            del self.cache[next(iter(self.cache))]
+        self.cache[token.word] = features
+        return features
+
+    def token_to_features(self, token):
+        """Generates the features of a token.
+        Args:
+            token: The token/word to convert.
+        Returns:
+            Tuple of features (strings).
+        """
+        word = token.word
+        classes = word.translate(_CHARACTER_CLASS_TABLE)
+        return (_STARTS_WITH_UPPERCASE[word[0].istitle() if word else False],
+                self.length_features[min(len(word), self.max_length)],
+                _CONTAINS_DIGITS["9" in classes],
+                _CONTAINS_PUNCTUATION["." in classes],
+                _ONLY_DIGITS[len(classes) > 0 and not classes.strip("9")],
+                _ONLY_PUNCTUATION[len(classes) > 0 and not classes.strip(".")],
+                "wp=%s" % (self.word_pattern.token_to_wordpattern(token)),
+                "pf=%s" % (word[0:3].translate(_AFFIX_TABLE)),
+                "sf=%s" % (word[-3:].translate(_AFFIX_TABLE)),
+                intern("word_feature=%s" % word))
+
 class StartsWithUppercaseFeature(object):
     """Generates a feature that describes, whether a given token starts with an uppercase letter."""
     def __init__(self):
@@ -157,19 +343,15 @@ class StartsWithUppercaseFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
-        result = []
-        for token in window.tokens:
-            result.append(["swu=%d" % (int(token.word[:1].istitle()))])
-        return result
+        return [[_STARTS_WITH_UPPERCASE[token.word[0].istitle() if token.word else False]]
+                for token in window.tokens]
 
 class WordFeature(object):
     def __init__(self):
-        pass
+        self.word_features = {}
     def convert_window(self, window):
-        result = []
-        for token in window.tokens:
-            result.append(["word_feature=%s" % token.word])
-        return result
+        word_features = self.word_features
+        return [[_word_feature(word_features, token.word)] for token in window.tokens]
 
 class TokenLengthFeature(object):
     """Generates a feature that describes the character length of a token."""
@@ -180,6 +362,7 @@ class TokenLengthFeature(object):
                 will never get a "l=31" result, only "l=30" for a token with length >= 30.
         """
         self.max_length = max_length
+        self.length_features = _length_features(max_length)
 
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
@@ -191,16 +374,14 @@ class TokenLengthFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
-        result = []
-        for token in window.tokens:
-            result.append(["l=%d" % (min(len(token.word), self.max_length))])
-        return result
+        length_features, max_length = self.length_features, self.max_length
+        return [[length_features[min(len(token.word), max_length)]] for token in window.tokens]
 
 class ContainsDigitsFeature(object):
     """Generates a feature that describes, whether a token contains any digit."""
     def __init__(self):
         """Instantiates a new object of this feature generator."""
-        self.regexp_contains_digits = re.compile(r'[0-9]+')
+        pass
 
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
@@ -212,17 +393,13 @@ class ContainsDigitsFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
-        result = []
-        for token in window.tokens:
-            any_digits = self.regexp_contains_digits.search(token.word) is not None
-            result.append(["cD=%d" % (int(any_digits))])
-        return result
+        return [[_CONTAINS_DIGITS[not _DIGITS.isdisjoint(token.word)]] for token in window.tokens]
 
 class ContainsPunctuationFeature(object):
     """Generates a feature that describes, whether a token contains any punctuation."""
     def __init__(self):
         """Instantiates a new object of this feature generator."""
-        self.regexp_contains_punctuation = re.compile(r'[\.\,\:\;\(\)\[\]\?\!]+')
+        pass
 
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
@@ -234,17 +411,14 @@ class ContainsPunctuationFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
-        result = []
-        for token in window.tokens:
-            any_punct = self.regexp_contains_punctuation.search(token.word) is not None
-            result.append(["cP=%d" % (int(any_punct))])
-        return result
+        return [[_CONTAINS_PUNCTUATION[not _PUNCTUATION.isdisjoint(token.word)]]
+                for token in window.tokens]
 
 class OnlyDigitsFeature(object):
     """Generates a feature that describes, whether a token contains only digits."""
     def __init__(self):
         """Instantiates a new object of this feature generator."""
-        self.regexp_contains_only_digits = re.compile(r'^[0-9]+$')
+        pass
 
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
@@ -256,17 +430,14 @@ class OnlyDigitsFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
-        result = []
-        for token in window.tokens:
-            only_digits = self.regexp_contains_only_digits.search(token.word) is not None
-            result.append(["oD=%d" % (int(only_digits))])
-        return result
+        return [[_ONLY_DIGITS[len(token.word) > 0 and _DIGITS.issuperset(token.word)]]
+                for token in window.tokens]
 
 class OnlyPunctuationFeature(object):
     """Generates a feature that describes, whether a token contains only punctuation."""
     def __init__(self):
         """Instantiates a new object of this feature generator."""
-        self.regexp_contains_only_punctuation = re.compile(r'^[\.\,\:\;\(\)\[\]\?\!]+$')
+        pass
 
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
@@ -278,11 +449,8 @@ class OnlyPunctuationFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
-        result = []
-        for token in window.tokens:
-            only_punct = self.regexp_contains_only_punctuation.search(token.word) is not None
-            result.append(["oP=%d" % (int(only_punct))])
-        return result
+        return [[_ONLY_PUNCTUATION[len(token.word) > 0 and _PUNCTUATION.issuperset(token.word)]]
+                for token in window.tokens]
 
 class W2VClusterFeature(object):
     """Generates a feature that describes the word2vec cluster of the token."""
@@ -293,6 +461,8 @@ class W2VClusterFeature(object):
                 estimate the cluster of a word.
         """
         self.w2v_clusters = w2v_clusters
+        # cluster index -> its interned feature, shared by all the words of the cluster
+        self.cluster_features = {}
 
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
@@ -304,9 +474,14 @@ class W2VClusterFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
+        cluster_features = self.cluster_features
         result = []
         for token in window.tokens:
-            result.append(["w2v=%d" % (self.token_to_cluster(token))])
+            cluster = self.token_to_cluster(token)
+            feature = cluster_features.get(cluster)
+            if feature is None:
+                feature = cluster_features[cluster] = intern("w2v=%d" % (cluster))
+            result.append([feature])
         return result
 
     def token_to_cluster(self, token):
@@ -328,6 +503,8 @@ class BrownClusterFeature(object):
                 to estimate the brown cluster of a word.
         """
         self.brown_clusters = brown_clusters
+        # cluster id -> its interned feature, shared by all the words of the cluster
+        self.cluster_features = {}
 
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
@@ -339,9 +516,14 @@ class BrownClusterFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
+        cluster_features = self.cluster_features
         result = []
         for token in window.tokens:
-            result.append(["bc=%d" % (self.token_to_cluster(token))])
+            cluster = self.token_to_cluster(token)
+            feature = cluster_features.get(cluster)
+            if feature is None:
+                feature = cluster_features[cluster] = intern("bc=%d" % (cluster))
+            result.append([feature])
         return result
 
     def token_to_cluster(self, token):
@@ -363,6 +545,8 @@ class BrownClusterBitsFeature(object):
                 to estimate the brown cluster bitchain of a word.
         """
         self.brown_clusters = brown_clusters
+        # prefix of a bitchain -> its interned feature, shared by all the words below it
+        self.bitchain_features = {}
 
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
@@ -374,9 +558,14 @@ class BrownClusterBitsFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
+        bitchain_features = self.bitchain_features
         result = []
         for token in window.tokens:
-            result.append(["bcb=%s" % (self.token_to_bitchain(token)[0:7])])
+            bitchain = self.token_to_bitchain(token)[0:7]
+            feature = bitchain_features.get(bitchain)
+            if feature is None:
+                feature = bitchain_features[bitchain] = intern("bcb=%s" % (bitchain))
+            result.append([feature])
         return result
 
     def token_to_bitchain(self, token):
@@ -398,6 +587,9 @@ class GazetteerOfficialName(object):
                 to estimate whether a word is contained in an Gazetteer.
         """
         self.g = gazetteer
+        # the two feature values, indexed by whether the word is an official name
+        self.features = (intern("g_official_%s=0" % gazetteer.type),
+                         intern("g_official_%s=1" % gazetteer.type))
 
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
@@ -409,198 +601,215 @@ class GazetteerOfficialName(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
-        result = []
-        for token in window.tokens:
-            result.append(["g_official_{}=%d".format(self.g.type) % (int(self.g.contains_as_official_name(token.word)))])
-        return result
+        return [[self.features[self.g.contains_as_official_name(token.word)]]
+                for token in window.tokens]
 
 class GazetteerSynonym(object):
     def __init__(self, gazetteer):
         self.g = gazetteer
+        # the two feature values, indexed by whether the word is a synonym
+        self.features = (intern("g_synonym_%s=0" % gazetteer.type),
+                         intern("g_synonym_%s=1" % gazetteer.type))
     
     def convert_window(self, window):
-        result = []
-        for token in window.tokens:
-            result.append(["g_synonym_{}=%d".format(self.g.type) % (int(self.g.contains_as_synonym(token.word)))])
-        return result
+        return [[self.features[self.g.contains_as_synonym(token.word)]]
+                for token in window.tokens]
 
 class AllGazetteerMinimumDistanceToken(object):
     def __init__(self, gazetteer):
         self._g = gazetteer
-        self._cache = Cache()
     
     def convert_window(self, window):
+        return self.convert_windows([window])[0]
+
+    def convert_windows(self, windows):
+        # the words of all the windows that the gazetteer hasn't cached are searched together
+        minimum_distances = iter(self._g.minimum_distances_to_tokens(
+            [token.word for window in windows for token in window.tokens]))
         result = []
-        for token in window.tokens:
-            minimum_distance = self._cache.get(token.word, None)
-            if minimum_distance is None:
-                minimum_distance = self._g.minimum_distance_to_token(token.word)
+        for window in windows:
+            window_result = []
+            for _ in window.tokens:
+                minimum_distance = next(minimum_distances)
                 #minimum_distance = bucketize_minimum_distance(minimum_distance)
-                self._cache.set(token.word, minimum_distance)
-            result.append(["g_minimum_distance_token=%f" % minimum_distance])
+                window_result.append(["g_minimum_distance_token=%f" % minimum_distance])
+            result.append(window_result)
         return result
 
 class AllGazetteerMinimumDistanceEntry(object):
     def __init__(self, gazetteer):
         self._g = gazetteer
-        self._cache = Cache()
     
     def convert_window(self, window):
+        return self.convert_windows([window])[0]
+
+    def convert_windows(self, windows):
+        # the words of all the windows that the gazetteer hasn't cached are searched together
+        minimum_distances = iter(self._g.minimum_distances_to_entries(
+            [token.word for window in windows for token in window.tokens]))
         result = []
-        for token in window.tokens:
-            minimum_distance = self._cache.get(token.word, None)
-            if minimum_distance is None:
-                minimum_distance = self._g.minimum_distance_to_entry(token.word)
+        for window in windows:
+            window_result = []
+            for _ in window.tokens:
+                minimum_distance = next(minimum_distances)
                 #minimum_distance = bucketize_minimum_distance(minimum_distance)
-                self._cache.set(token.word, minimum_distance)
-            result.append(["g_minimum_distance_entry=%f" % minimum_distance])
+                window_result.append(["g_minimum_distance_entry=%f" % minimum_distance])
+            result.append(window_result)
         return result
 
 class AllGazetteerClosestEntryType(object):
     def __init__(self, gazetteer):
         self._g = gazetteer
-        self._cache = Cache()
     
     def convert_window(self, window):
-        result = []
-        for token in window.tokens:
-            types = self._cache.get(token.word, None)
-            if types is None:
-                types = self._g.closest_entry_types(token.word)
-                self._cache.set(token.word, types)
-            result.append(["g_types_entry=%s" % types])
-        return result
+        return self.convert_windows([window])[0]
+
+    def convert_windows(self, windows):
+        # the words of all the windows that the gazetteer hasn't cached are searched together
+        closest_types = iter(self._g.closest_entry_types_batch(
+            [token.word for window in windows for token in window.tokens]))
+        return [[["g_types_entry=%s" % next(closest_types)] for _ in window.tokens]
+                for window in windows]
 
 class AllGazetteerClosestTokenType(object):
     def __init__(self, gazetteer):
         self._g = gazetteer
-        self._cache = Cache()
     
     def convert_window(self, window):
-        result = []
-        for token in window.tokens:
-            types = self._cache.get(token.word, None)
-            if types is None:
-                types = self._g.closest_token_types(token.word)
-                self._cache.set(token.word, types)
-            result.append(["g_types_token=%s" % types])
-        return result
+        return self.convert_windows([window])[0]
+
+    def convert_windows(self, windows):
+        # the words of all the windows that the gazetteer hasn't cached are searched together
+        closest_types = iter(self._g.closest_token_types_batch(
+            [token.word for window in windows for token in window.tokens]))
+        return [[["g_types_token=%s" % next(closest_types)] for _ in window.tokens]
+                for window in windows]
 
 class AllGazetteerClosestTypeNGram(object):
     def __init__(self, g, ngram):
         self._g = g
         self._ngram = ngram
-        self._cache = Cache()
+        self._template = "g_%dgram_types=%%s" % ngram
+        # the feature of the last tokens, that don't start an ngram
+        self._no_ngram_feature = self._template % "NONE"
     
-    def _find_ngrams(self, input_list, ngram):
-        return list(zip(*[input_list[i:] for i in range(ngram)]))
-
     def convert_window(self, window):
+        return self.convert_windows([window])[0]
+
+    def convert_windows(self, windows):
+        windows_phrases = [window.get_ngram_phrases(self._ngram) for window in windows]
+        # the phrases of all the windows that the gazetteer hasn't cached are searched together
+        closest_types = iter(self._g.closest_entry_types_batch(
+            [phrase for phrases in windows_phrases for phrase in phrases]))
         result = []
-        ngrams = self._find_ngrams(window.tokens, self._ngram)
-        for token_ngram in ngrams:
-            phrase = " ".join([token.word for token in token_ngram])
-            closest_types = self._cache.get(phrase, None)
-            if closest_types is None:
-                closest_types = self._g.closest_entry_types(phrase)
-                self._cache.set(phrase, closest_types)
-            result.append(["g_{}gram_types=%s".format(self._ngram) % closest_types])
-        for _ in range(len(ngrams), len(window.tokens)):
-            result.append(["g_{}gram_types=%s".format(self._ngram) % "NONE"])
+        for window, phrases in zip(windows, windows_phrases):
+            window_result = []
+            for _ in phrases:
+                window_result.append([self._template % next(closest_types)])
+            for _ in range(len(phrases), len(window.tokens)):
+                window_result.append([self._no_ngram_feature])
+            result.append(window_result)
         return result
 
 class AllGazetteerMinimumDistanceNGram(object):
     def __init__(self, g, ngram):
         self._g = g
         self._ngram = ngram
-        self._cache = Cache()
+        self._template = "g_%dgram_distance=%%d" % ngram
+        # the feature of the last tokens, that don't start an ngram
+        self._no_ngram_feature = self._template % 1.0
     
-    def _find_ngrams(self, input_list, ngram):
-        return list(zip(*[input_list[i:] for i in range(ngram)]))
+    def _minimum_distances(self, phrases):
+        return [bucketize_minimum_distance(minimum_distance)
+                for minimum_distance in self._g.minimum_distances_to_entries(phrases)]
     
     def convert_window(self, window):
+        return self.convert_windows([window])[0]
+
+    def convert_windows(self, windows):
+        windows_phrases = [window.get_ngram_phrases(self._ngram) for window in windows]
+        # the phrases of all the windows that the gazetteer hasn't cached are searched together
+        minimum_distances = iter(self._minimum_distances(
+            [phrase for phrases in windows_phrases for phrase in phrases]))
         result = []
-        ngrams = self._find_ngrams(window.tokens, self._ngram)
-        for token_ngram in ngrams:
-            phrase = " ".join([token.word for token in token_ngram])
-            minimum_distance = self._cache.get(phrase, None)
-            if minimum_distance is None:
-                minimum_distance = self._g.minimum_distance_to_entry(phrase)
-                minimum_distance = bucketize_minimum_distance(minimum_distance)
-                self._cache.set(phrase, minimum_distance)
-            result.append(["g_{}gram_distance=%d".format(self._ngram) % minimum_distance])
-        for _ in range(len(ngrams), len(window.tokens)):
-            result.append(["g_{}gram_distance=%d".format(self._ngram) % 1.0])
+        for window, phrases in zip(windows, windows_phrases):
+            window_result = []
+            for _ in phrases:
+                window_result.append([self._template % next(minimum_distances)])
+            for _ in range(len(phrases), len(window.tokens)):
+                window_result.append([self._no_ngram_feature])
+            result.append(window_result)
         return result
 
 class GazetteerClosestToken(object):
     def __init__(self, gazetteer):
         self.g = gazetteer
-        self.cache = Cache()
+        self.cache = WRCache()
+        self.template = "g_closest_%s=%%s" % gazetteer.type
 
     def convert_window(self, window):
         result = []
         for token in window.tokens:
-            closest_token = self.cache.get(token.word, None)
-            if closest_token is None:
-                closest_token = self.g.closest_token(token.word)
-                self.cache.set(token.word, closest_token)
-            result.append(["g_closest_{}=%s".format(self.g.type) % closest_token])
+            closest_token = self.cache.get_or_compute(token.word, self.g.closest_token)
+            result.append([self.template % closest_token])
         return result
 
 class GazetteerTokenPosition(object):
     def __init__(self, gazetteer):
         self.g = gazetteer
-        self.cache = Cache()
+        self.cache = WRCache()
+        self.template = "g_token_position_%s=%%d" % gazetteer.type
+
+    def _token_position(self, word):
+        closest_token = self.g.closest_token(word)
+        return self.g.token_position_in_name(closest_token)
     
     def convert_window(self, window):
         result = []
         for token in window.tokens:
-            token_position = self.cache.get(token.word, None)
-            if token_position is None:
-                closest_token = self.g.closest_token(token.word)
-                token_position = self.g.token_position_in_name(closest_token)
-                self.cache.set(token.word, token_position)
+            token_position = self.cache.get_or_compute(token.word, self._token_position)
 
-            result.append(["g_token_position_{}=%d".format(self.g.type) % token_position])
+            result.append([self.template % token_position])
         return result
     
 
 class GazetteerMinimumDistanceOfficialName(object):
     def __init__(self, gazetteer):
         self.g = gazetteer
+        self.template = "g_official_distance_%s=%%f" % gazetteer.type
     
     def convert_window(self, window):
         result = []
         for token in window.tokens:
-            result.append(["g_official_distance_{}=%f".format(self.g.type) % self.g.minimum_distance_to_official_name(token.word)])
+            result.append([self.template % self.g.minimum_distance_to_official_name(token.word)])
         return result
 
 class GazetteerMinimumDistanceSynonym(object):
     def __init__(self, gazetteer):
         self.g = gazetteer
+        self.template = "g_synonym_distance_%s=%%f" % gazetteer.type
     
     def convert_window(self, window):
         result = []
         for token in window.tokens:
-            result.append(["g_synonym_distance_{}=%f".format(self.g.type) % self.g.minimum_distance_to_synonym(token.word)])
+            result.append([self.template % self.g.minimum_distance_to_synonym(token.word)])
             
         return result
 
 class GazetteerMinimumDistanceToken(object):
     def __init__(self, gazetteer):
         self.g = gazetteer
-        self.cache = Cache()
+        self.cache = WRCache()
+        self.template = "g_token_distance_%s=%%d" % gazetteer.type
+
+    def _minimum_distance(self, word):
+        return bucketize_minimum_distance(self.g.minimum_distance_to_token(word))
     
     def convert_window(self, window):
         result = []
         for token in window.tokens:
-            minimum_distance = self.cache.get(token.word, None)
-            if minimum_distance is None:
-                minimum_distance = self.g.minimum_distance_to_token(token.word)
-                minimum_distance = bucketize_minimum_distance(minimum_distance)
-                self.cache.set(token.word, minimum_distance)
-            result.append(["g_token_distance_{}=%d".format(self.g.type) % minimum_distance])
+            minimum_distance = self.cache.get_or_compute(token.word, self._minimum_distance)
+            result.append([self.template % minimum_distance])
         
         return result
 
@@ -608,24 +817,21 @@ class GazetteerMinimumDistanceNGram(object):
     def __init__(self, gazetteer, ngram):
         self.g = gazetteer
         self.ngram = ngram
-        self.cache = Cache()
+        self.cache = WRCache()
+        self.template = "g_%dgram_%s_distance=%%d" % (ngram, gazetteer.type)
+        # the feature of the last tokens, that don't start an ngram
+        self.no_ngram_feature = self.template % bucketize_minimum_distance(1.0)
     
-    def _find_ngrams(self, input_list, ngram):
-        return list(zip(*[input_list[i:] for i in range(ngram)]))
+    def _minimum_distance(self, phrase):
+        return bucketize_minimum_distance(self.g.minimum_distance_to_synonym(phrase))
 
     def convert_window(self, window):
         result = []
-        ngrams = self._find_ngrams(window.tokens, self.ngram)
-        for token_ngram in ngrams:
-            phrase = " ".join([token.word for token in token_ngram])
-            minimum_distance = self.cache.get(phrase, None)
-            if minimum_distance is None:
-                minimum_distance = self.g.minimum_distance_to_synonym(phrase)
-                minimum_distance = bucketize_minimum_distance(minimum_distance)
-                self.cache.set(phrase, minimum_distance)
-            result.append(["g_{}gram_{}_distance=%d".format(self.ngram, self.g.type) % minimum_distance])
-        for _ in range(len(ngrams), len(window.tokens)):
-            result.append(["g_{}gram_{}_distance=%d".format(self.ngram, self.g.type) % bucketize_minimum_distance(1.0)])
+        for phrase in window.get_ngram_phrases(self.ngram):
+            minimum_distance = self.cache.get_or_compute(phrase, self._minimum_distance)
+            result.append([self.template % minimum_distance])
+        for _ in range(len(result), len(window.tokens)):
+            result.append([self.no_ngram_feature])
         return result
 
 class WordPatternFeature(object):
@@ -646,24 +852,6 @@ class WordPatternFeature(object):
         # the cutoff
         self.max_length_char = "~"
 
-        self.normalization = [
-            (r"[A-ZÄÖÜ]", "A"),
-            (r"[a-zäöüß]", "a"),
-            (r"[0-9]", "9"),
-            (r"[\.\!\?\,\;]", "."),
-            (r"[\(\)\[\]\{\}]", "("),
-            (r"[^Aa9\.\(]", "#")
-        ]
-
-        # note: we do not map numers to 9+, e.g. years will still be 9999
-        self.mappings = [
-            (r"[A]{2,}", "A+"),
-            (r"[a]{2,}", "a+"),
-            (r"[\.]{2,}", ".+"),
-            (r"[\(]{2,}", "(+"),
-            (r"[#]{2,}", "#+")
-        ]
-
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
         Args:
@@ -674,10 +862,7 @@ class WordPatternFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
-        result = []
-        for token in window.tokens:
-            result.append(["wp=%s" % (self.token_to_wordpattern(token))])
-        return result
+        return [["wp=%s" % (self.token_to_wordpattern(token))] for token in window.tokens]
 
     def token_to_wordpattern(self, token):
         """Converts a token/word to its word pattern.
@@ -686,13 +871,11 @@ class WordPatternFeature(object):
         Returns:
             The word pattern as string.
         """
-        normalized = token.word
-        for from_regex, to_str in self.normalization:
-            normalized = re.sub(from_regex, to_str, normalized)
+        normalized = token.word.translate(_WORD_PATTERN_TABLE)
 
-        wpattern = normalized
-        for from_regex, to_str in self.mappings:
-            wpattern = re.sub(from_regex, to_str, wpattern)
+        # replace each run of two or more equal classes by the class and a "+", e.g. "aaa" by
+        # "a+"; note: we do not map numers to 9+, e.g. years will still be 9999
+        wpattern = _CLASS_RUNS.sub(_collapse_class_run, normalized)
 
         if len(wpattern) > self.max_length:
             wpattern = wpattern[0:self.max_length] + self.max_length_char
@@ -715,11 +898,7 @@ class PrefixFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
-        result = []
-        for token in window.tokens:
-            prefix = re.sub(r"[^a-zA-ZäöüÄÖÜß\.\,\!\?]", "#", token.word[0:3])
-            result.append(["pf=%s" % (prefix)])
-        return result
+        return [["pf=%s" % (token.word[0:3].translate(_AFFIX_TABLE))] for token in window.tokens]
 
 class SuffixFeature(object):
     """Generates a feature that describes the suffix (the last three chars) of the word."""
@@ -737,11 +916,7 @@ class SuffixFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
-        result = []
-        for token in window.tokens:
-            suffix = re.sub(r"[^a-zA-ZäöüÄÖÜß\.\,\!\?]", "#", token.word[-3:])
-            result.append(["sf=%s" % (suffix)])
-        return result
+        return [["sf=%s" % (token.word[-3:].translate(_AFFIX_TABLE))] for token in window.tokens]
 
 class POSTagFeature(object):
     """Generates a feature that describes the Part Of Speech tag of the word."""
@@ -752,6 +927,8 @@ class POSTagFeature(object):
                 to estimate the POS-tag of a word.
         """
         self.pos_tagger = pos_tagger
+        # POS tag -> its interned feature, there are only a few dozens of tags
+        self.pos_features = {}
 
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
@@ -763,14 +940,40 @@ class POSTagFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
-        pos_tags = self.default_pos_tag(window)
+        return self.pos_tags_to_features(window, self.default_pos_tag(window))
+
+    def convert_windows(self, windows):
+        """Converts several Window objects, like convert_window() does for one, POS-tagging all
+        of them with a single call to the tagger.
+        Args:
+            windows: List of Window objects (defined in datasets.py) to use.
+        Returns:
+            List with the lists of lists of features of each window.
+        """
+        pos_tags_lists = self.pos_tagger.tag_many([[token.word for token in window.tokens]
+                                                   for window in windows])
+        return [self.pos_tags_to_features(window, pos_tags)
+                for window, pos_tags in zip(windows, pos_tags_lists)]
+
+    def pos_tags_to_features(self, window, pos_tags):
+        """Converts the POS tags of a window to its list of lists of features.
+        Args:
+            window: The Window object (defined in datasets.py) that was POS-tagged.
+            pos_tags: List of tuples with the token and the tag, for the window.
+        Returns:
+            List of lists of features, see convert_window().
+        """
         result = []
         
         # catch stupid problems with stanford POS tagger and unicode characters
         if len(pos_tags) == len(window.tokens):
+            pos_features = self.pos_features
             # _ is the word
             for _, pos_tag in pos_tags:
-                result.append(["pos=%s" % (pos_tag)])
+                feature = pos_features.get(pos_tag)
+                if feature is None:
+                    feature = pos_features[pos_tag] = intern("pos=%s" % (pos_tag))
+                result.append([feature])
         else:
             orig_str = "|".join([token.word for token in window.tokens])
             pos_str = "|".join([word for word, _ in pos_tags])
@@ -813,6 +1016,9 @@ class LDATopicFeature(object):
         self.window_left_size = window_left_size
         self.window_right_size = window_right_size
         self.prob_threshold = prob_threshold
+        # the interned feature of each topic, indexed by the topic
+        self.topic_features = tuple(intern("lda_%d=%s" % (topic_idx, "1"))
+                                    for topic_idx in range(lda_wrapper.lda.num_topics))
 
     def convert_window(self, window):
         """Converts a Window object into a list of lists of features, where features are strings.
@@ -824,18 +1030,35 @@ class LDATopicFeature(object):
             Each list can contain any number of features (including 0).
             Each feature is a string.
         """
+        return self.convert_windows([window])[0]
+
+    def convert_windows(self, windows):
+        """Converts several Window objects, like convert_window() does for one, inferring the
+        topics of the text windows around all their tokens with a single call to the LDA.
+        Args:
+            windows: List of Window objects (defined in datasets.py) to use.
+        Returns:
+            List with the lists of lists of features of each window.
+        """
+        texts = []
+        for window in windows:
+            words = [token.word for token in window.tokens]
+            for i in range(len(words)):
+                window_start = max(0, i - self.window_left_size)
+                window_end = min(len(words), i + self.window_right_size + 1)
+                texts.append(" ".join(words[window_start:window_end]))
+        topics_lists = iter(self.lda_wrapper.get_topics_many(texts))
+
         result = []
-        for i, token in enumerate(window.tokens):
-            token_features = []
-            window_start = max(0, i - self.window_left_size)
-            window_end = min(len(window.tokens), i + self.window_right_size + 1)
-            window_tokens = window.tokens[window_start:window_end]
-            text = " ".join([token.word for token in window_tokens])
-            topics = self.get_topics(text)
-            for (topic_idx, prob) in topics:
-                if prob > self.prob_threshold:
-                    token_features.append("lda_%d=%s" % (topic_idx, "1"))
-            result.append(token_features)
+        for window in windows:
+            window_result = []
+            for _ in window.tokens:
+                token_features = []
+                for (topic_idx, prob) in next(topics_lists):
+                    if prob > self.prob_threshold:
+                        token_features.append(self.topic_features[topic_idx])
+                window_result.append(token_features)
+            result.append(window_result)
         return result
 
     def get_topics(self, text):
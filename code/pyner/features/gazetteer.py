@@ -5,66 +5,637 @@ A Gazetteer contains a set of words that are names (e.g. names of people)."""
 
 from __future__ import absolute_import, division, print_function, unicode_literals
 from array import array
-import operator
-    
-class TrieNode:
+from bisect import bisect_left
+from collections import OrderedDict
+import os
+import pickle
+import sys
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    # numba is optional, without it the gazetteers are searched in pure Python
+    njit = None
+
+try:
+    import ahocorasick
+except ImportError:
+    # pyahocorasick is optional, without it Gazetteer.iter_mentions scans the text in Python
+    ahocorasick = None
+
+try:
+    _bit_count = int.bit_count
+except AttributeError:
+    # int.bit_count is new in Python 3.10
+    def _bit_count(x):
+        return bin(x).count("1")
+
+# Flags telling what a word of a gazetteer trie is; a word may have several of them
+OFFICIAL_NAME = 1
+SYNONYM = 2
+
+# Maximum number of phrases remembered by each result cache of a Gazetteer or AllGazetteer
+MAX_CACHE_SIZE = 200000
+
+# Plain dicts only keep the insertion order since Python 3.7: the caches evicting their oldest
+# entry need an OrderedDict before
+_InsertionOrderedDict = dict if sys.version_info >= (3, 7) else OrderedDict
+
+# Suffix of the file an AllGazetteer is pickled to by load_all_gazetteer(), next to the file of
+# its first type
+GAZETTEER_CACHE_SUFFIX = ".all.pkl"
+
+# Version of the pickled AllGazetteers, to increase whenever AllGazetteer, FlatTrie or the
+# filling of a gazetteer change: the caches pickled with another version are built again
+GAZETTEER_CACHE_VERSION = 1
+
+# os.replace is new in Python 3.3
+_replace = getattr(os, "replace", os.rename)
+
+# Maximum Levenshtein distance of a match, relative to the length of the phrase
+DISTANCE_PERCENTAGE = 0.30
+
+def _max_distance(phrase):
+    """Returns the maximum Levenshtein distance of a match of the phrase."""
+    return max(1, int(len(phrase) * DISTANCE_PERCENTAGE))
+
+def _match_distance(phrase, match):
+    """Returns the distance value of the closest match (see closest_match()) of a phrase: its
+    Levenshtein distance relative to the length of the phrase, or 1.0 if there is no match."""
+    if match is not None:
+        return match[1] / float(len(phrase))
+    return 1.0
+
+def _length_within(lengths, length, max_cost):
+    """Returns whether the sorted list lengths contains a value within max_cost of length,
+    that is, whether a word of one of these lengths can be within max_cost of a word of the
+    given length."""
+    idx = bisect_left(lengths, length - max_cost)
+    return idx < len(lengths) and lengths[idx] <= length + max_cost
+
+def _cache_set(cache, key, value):
+    """Adds a result to a cache (an _InsertionOrderedDict), evicting its oldest entry if it is
+    full."""
+    if len(cache) >= MAX_CACHE_SIZE:
+        del cache[next(iter(cache))]
+    cache[key] = value
+
+class TrieNode(object):
+    """Node of the trie built while filling a gazetteer.
+    The children are stored in two parallel sequences sorted by letter: chars holds their
+    letters (as a string) and kids the child nodes. The node ending a word keeps the union of
+    the (non zero) flags it was inserted with, the other nodes have no flags. The word itself is
+    not stored: it is spelled by the path from the root."""
+    __slots__ = ('chars', 'kids', 'flags')
+
     def __init__(self):
-        self.word = None
-        self.children = {}
+        self.flags = 0
+        self.chars = ""
+        self.kids = []
 
-    def insert(self, word):
+    def insert(self, word, flags=1):
         node = self
         for letter in word:
-            if letter not in node.children: 
-                node.children[letter] = TrieNode()
-            node = node.children[letter]
-        node.word = word
+            idx = bisect_left(node.chars, letter)
+            if idx == len(node.chars) or node.chars[idx] != letter:
+                node.chars = node.chars[:idx] + letter + node.chars[idx:]
+                node.kids.insert(idx, TrieNode())
+            node = node.kids[idx]
+        node.flags |= flags
 
-def search(trie, word, max_cost):
-    # build first row
-    current_row = array('i', range(len(word) + 1))
+class FlatTrie(object):
+    """Read-only copy of a trie, compacted into a radix tree and flattened into parallel arrays.
+    Chains of nodes with a single child and no word are merged into a single edge, labelled with
+    all their letters. The nodes are numbered in breadth-first order, node 0 being the root. The
+    children of node n are reached through the edges child_first[n] to
+    child_first[n] + child_count[n] - 1, which are sorted by their first letter, so that all
+    children of a node lie next to each other.
+    Members:
+        child_first: Index of the first edge of each node.
+        child_count: Number of edges (children) of each node.
+        edge_label: Index in label_chars of the first letter of each edge's label; the label of
+            edge e ends where the one of edge e + 1 starts (there is one extra entry at the end).
+        label_chars: Unicode code points of the letters of all the labels.
+        child_idx: Index of the node each edge leads to.
+        word_id: Index in words of the word ending at each node, -1 if there is none.
+        word_flags: Flags of the word ending at each node, 0 if there is none.
+        min_length: Length of the shortest word in the subtree of each node.
+        max_length: Length of the longest word in the subtree of each node.
+        words: The words stored in the trie.
+        stack_size: Upper bound of the size of the stack of a depth-first search of the trie.
+        jit_arrays: The arrays above as NumPy arrays for _search_jit, None without numba.
+    """
+    def __init__(self, trie):
+        """Flattens a trie.
+        Args:
+            trie: The root TrieNode of the trie to flatten.
+        """
+        self.child_first = array('i')
+        self.child_count = array('i')
+        self.edge_label = array('i')
+        self.label_chars = array('i')
+        self.child_idx = array('i')
+        self.word_id = array('i')
+        self.word_flags = array('i')
+        self.words = []
 
-    results = []
-    
-    for letter in trie.children:
-        stack = [(trie.children[letter], letter, word, current_row, results)]    
-        search_stack(stack, max_cost)
+        nodes = [trie]
+        # the word spelled by the path to each node, dropped once the node is numbered
+        prefixes = [""]
+        for n, node in enumerate(nodes):
+            prefix = prefixes[n]
+            prefixes[n] = None
+            self.child_first.append(len(self.child_idx))
+            self.child_count.append(len(node.kids))
+            self.word_flags.append(node.flags)
+            if not node.flags:
+                self.word_id.append(-1)
+            else:
+                self.word_id.append(len(self.words))
+                self.words.append(prefix)
+
+            for letter, child in zip(node.chars, node.kids):
+                self.edge_label.append(len(self.label_chars))
+                label = letter
+                # skip the nodes that neither end a word nor branch
+                while not child.flags and len(child.kids) == 1:
+                    label += child.chars[0]
+                    child = child.kids[0]
+                self.label_chars.extend(ord(label_letter) for label_letter in label)
+                self.child_idx.append(len(nodes))
+                nodes.append(child)
+                prefixes.append(prefix + label)
+        self.edge_label.append(len(self.label_chars))
+
+        # children are numbered after their parent, so a backward pass sees them first
+        # (only the root of an empty trie has no word below it)
+        self.min_length = array('i', [1 << 30]) * len(nodes)
+        self.max_length = array('i', [-1]) * len(nodes)
+        for n in range(len(nodes) - 1, -1, -1):
+            if self.word_id[n] >= 0:
+                self.min_length[n] = self.max_length[n] = len(self.words[self.word_id[n]])
+            first = self.child_first[n]
+            for edge in range(first, first + self.child_count[n]):
+                child = self.child_idx[edge]
+                if self.min_length[child] < self.min_length[n]:
+                    self.min_length[n] = self.min_length[child]
+                if self.max_length[child] > self.max_length[n]:
+                    self.max_length[n] = self.max_length[child]
+
+        # every leaf ends a word, so the longest word is as long as the deepest path
+        self.stack_size = 1 + max(0, self.max_length[0]) * max(self.child_count)
+        self._set_jit_arrays()
+
+    def _set_jit_arrays(self):
+        """Sets jit_arrays, as views of the arrays (not copies)."""
+        self.jit_arrays = None
+        if njit is not None:
+            self.jit_arrays = tuple(np.frombuffer(column, dtype=np.intc) for column in
+                                    (self.child_first, self.child_count, self.edge_label,
+                                     self.label_chars, self.child_idx, self.word_id,
+                                     self.word_flags, self.min_length, self.max_length))
+
+    def __getstate__(self):
+        # the NumPy views would be pickled as copies of the arrays, and may not be usable where
+        # the trie is unpickled (without numba): they are rebuilt instead
+        state = self.__dict__.copy()
+        del state["jit_arrays"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._set_jit_arrays()
+
+def _pattern_mask(word):
+    """Returns a dict mapping each letter (as code point) of word to a bitmask, whose bit j is
+    set iff word[j] is that letter."""
+    pattern_mask = {}
+    for idx, letter in enumerate(word):
+        code = ord(letter)
+        pattern_mask[code] = pattern_mask.get(code, 0) | (1 << idx)
+    return pattern_mask
+
+def closest_match(trie, word, max_cost, flag_mask=-1):
+    """Returns the word in the trie with the lowest Levenshtein distance to word, among the words
+    having any of the flags in flag_mask (by default, all the words).
+    Uses Myers' bit-parallel algorithm: instead of a full row of the dynamic programming table,
+    each letter of the trie only carries the vertical deltas of its column, packed into two
+    integers.
+    The search is a branch and bound: it stops exploring a branch of the trie as soon as it
+    cannot contain a closer word than the best one found so far.
+    If several words have the lowest distance, the first one found by the depth-first search
+    is chosen.
+    Uses the compiled _search_jit if numba is available and the word fits into 64 bits.
+    Args:
+        trie: The FlatTrie to search.
+        word: The word to search for.
+        max_cost: The maximum Levenshtein distance of a match.
+        flag_mask: The flags a match may have.
+    Returns:
+        Tuple of the form (word, distance),
+        or None if no word is within max_cost.
+    """
+    if trie.jit_arrays is not None and 0 < len(word) <= 64:
+        word_codes = np.array([ord(letter) for letter in word], dtype=np.intc)
+        best_idx, best_cost = _search_jit(*(trie.jit_arrays + (word_codes, max_cost, flag_mask,
+                                                              trie.stack_size)))
+        if best_idx < 0:
+            return None
+        return (trie.words[best_idx], best_cost)
+
+    pattern_mask = _pattern_mask(word)
+    # lowest distance found so far (initially just out of reach) and the id of its word
+    best = [max_cost + 1, -1]
+
+    # the first column of the table is 0, 1, ..., len(word): all vertical deltas are positive
+    vp = (1 << len(word)) - 1
+    first = trie.child_first[0]
+    for edge in range(first, first + trie.child_count[0]):
+        stack = [(edge, vp, 0, len(word), 0)]
+        closest_stack(trie, stack, pattern_mask, len(word), flag_mask, best)
+        if best[0] == 0:
+            break
+
+    if best[1] < 0:
+        return None
+    return (trie.words[best[1]], best[0])
+
+def closest_stack(trie, stack, pattern_mask, word_length, flag_mask, best):
+    '''
+    Searches iteratively for the closest word in the trie having any of the flags in flag_mask,
+    keeping the first match with the lowest distance in best, as [distance, word id].
+    Each stack entry holds an edge, the vertical positive/negative delta bitvectors of the
+    column before its label, the distance and the depth there.
+    Branches that cannot lead to a lower distance than best[0] are not searched, and the search
+    stops at the first exact match.
+    '''
+    child_first = trie.child_first
+    child_count = trie.child_count
+    edge_label = trie.edge_label
+    label_chars = trie.label_chars
+    child_idx = trie.child_idx
+    word_id = trie.word_id
+    word_flags = trie.word_flags
+    min_length = trie.min_length
+    max_length = trie.max_length
+
+    # the methods and the best distance used for every letter, as locals
+    pop = stack.pop
+    push = stack.append
+    letter_mask = pattern_mask.get
+    bit_count = _bit_count
+    best_cost, best_word = best
+
+    mask = (1 << word_length) - 1
+    # bit of the last row once the horizontal deltas are shifted down by one row
+    last_row = 1 << word_length
+
+    while stack:
+        edge, vp, vn, score, depth = pop()
+        # the distance to a word is at least the difference of the lengths: skip the branch
+        # if all its words are too long or too short to beat the best one
+        node = child_idx[edge]
+        if (min_length[node] - word_length >= best_cost
+                or word_length - max_length[node] >= best_cost):
+            continue
+
+        for pos in range(edge_label[edge], edge_label[edge + 1]):
+            eq = letter_mask(label_chars[pos], 0)
+            d0 = ((((eq & vp) + vp) ^ vp) | eq | vn) & mask
+            hp = vn | (~(vp | d0) & mask)
+            hn = vp & d0
+
+            # shift the horizontal deltas to the row below; the first row always grows by one,
+            # since the distance from the empty word to a prefix of length depth is depth
+            hp = (hp << 1) | 1
+            hn = hn << 1
+            if hp & last_row:
+                score += 1
+            elif hn & last_row:
+                score -= 1
+
+            vn = hp & d0
+            vp = (hn | ~(hp | d0)) & mask
+            depth += 1
+
+            # No entry of the column can be lower than the last entry minus all the positive
+            # deltas, nor lower than the first entry (depth) minus all the negative deltas.
+            # If this bound is not below the best distance so far, give up the branch.
+            # (compared by hand: a call to max() costs more than the rest of the bound)
+            lower_bound = score - bit_count(vp)
+            first_bound = depth - bit_count(vn)
+            if first_bound > lower_bound:
+                lower_bound = first_bound
+            if lower_bound >= best_cost:
+                break
+        else:
+            # if there is a word in this trie node closer than the best one so far, keep it
+            if score < best_cost and word_flags[node] & flag_mask:
+                best_cost = score
+                best_word = word_id[node]
+                if score == 0:
+                    break
+
+            if lower_bound < best_cost:
+                first = child_first[node]
+                for child_edge in range(first, first + child_count[node]):
+                    push((child_edge, vp, vn, score, depth))
+
+    best[0] = best_cost
+    best[1] = best_word
+
+def closest_matches(trie, words, max_costs, flag_masks=None):
+    """Batched closest_match(): returns the closest word in the trie for each word of a list.
+    The words are all searched in a single walk over the trie, in which each edge updates the
+    bit-parallel state of every word still able to find a closer match below it. A branch is
+    only skipped once it is hopeless for all of them. With numba, the whole batch is searched
+    by a single call to the compiled search.
+    Args:
+        trie: The FlatTrie to search.
+        words: List of words to search for.
+        max_costs: List with the maximum Levenshtein distance of a match, for each word.
+        flag_masks: List with the flags a match may have, for each word (by default, all the
+            words of the trie may match).
+    Returns:
+        List with, for each word, a tuple of the form (word, distance), or None if no word is
+        within its max_cost.
+    """
+    if flag_masks is None:
+        flag_masks = [-1] * len(words)
+    results = [None] * len(words)
+    pending = list(range(len(words)))
+
+    if trie.jit_arrays is not None:
+        compiled = [k for k in pending if 0 < len(words[k]) <= 64]
+        pending = [k for k in pending if not 0 < len(words[k]) <= 64]
+        if compiled:
+            word_codes = np.zeros((len(compiled), 64), dtype=np.intc)
+            for row, k in enumerate(compiled):
+                word_codes[row, :len(words[k])] = [ord(letter) for letter in words[k]]
+            word_lengths = np.array([len(words[k]) for k in compiled], dtype=np.int64)
+            word_max_costs = np.array([max_costs[k] for k in compiled], dtype=np.int64)
+            word_flag_masks = np.array([flag_masks[k] for k in compiled], dtype=np.int64)
+            best_idx, best_cost = _search_batch_jit(*(trie.jit_arrays + (
+                word_codes, word_lengths, word_max_costs, word_flag_masks, trie.stack_size)))
+            for row, k in enumerate(compiled):
+                if best_idx[row] >= 0:
+                    results[k] = (trie.words[best_idx[row]], int(best_cost[row]))
+
+    if pending:
+        pattern_masks = [_pattern_mask(words[k]) for k in pending]
+        word_lengths = [len(words[k]) for k in pending]
+        pending_flag_masks = [flag_masks[k] for k in pending]
+        best = [[max_costs[k] + 1, -1] for k in pending]
+        # one (index in pending, vp, vn, distance) state per word
+        states = [(i, (1 << word_lengths[i]) - 1, 0, word_lengths[i])
+                  for i in range(len(pending))]
+
+        first = trie.child_first[0]
+        for edge in range(first, first + trie.child_count[0]):
+            stack = [(edge, states, 0)]
+            closest_batch_stack(trie, stack, pattern_masks, word_lengths, pending_flag_masks,
+                                best)
+
+        for i, k in enumerate(pending):
+            if best[i][1] >= 0:
+                results[k] = (trie.words[best[i][1]], best[i][0])
     return results
 
-def search_stack(stack, max_cost):
+def closest_batch_stack(trie, stack, pattern_masks, word_lengths, flag_masks, best):
     '''
-    Searches recursively for the word in the trie.
+    Like closest_stack(), but each stack entry holds a list of states, one for each word that
+    may still find a closer match in the branch, in the place of a single (vp, vn, distance).
     '''
-    
+    child_first = trie.child_first
+    child_count = trie.child_count
+    edge_label = trie.edge_label
+    label_chars = trie.label_chars
+    child_idx = trie.child_idx
+    word_id = trie.word_id
+    word_flags = trie.word_flags
+    min_length = trie.min_length
+    max_length = trie.max_length
+
+    pop = stack.pop
+    push = stack.append
+    bit_count = _bit_count
+    letter_masks = [pattern_mask.get for pattern_mask in pattern_masks]
+    masks = [(1 << word_length) - 1 for word_length in word_lengths]
+    last_rows = [1 << word_length for word_length in word_lengths]
+
     while stack:
-        node, letter, word, previous_row, results = stack.pop()
-        columns = len(word) + 1
-        current_row = array('i', [0]*(len(word) + 1))
-        current_row[0] = previous_row[0] + 1
-
-        # Build one row for the letter, with a column for each letter in the target
-        # word, plus one for the empty string at column 0
-        for column in range(1, columns):
-            insert_cost = current_row[column - 1] + 1
-            delete_cost = previous_row[column] + 1
-
-            if word[column - 1] != letter:
-                replace_cost = previous_row[column - 1] + 1
-            else:                
-                replace_cost = previous_row[column - 1]
-
-            current_row[column] = min(insert_cost, delete_cost, replace_cost)
-
-        # if the last entry in the row indicates the optimal cost is less than the
-        # maximum cost, and there is a word in this trie node, then add it.
-        if current_row[-1] <= max_cost and node.word != None:
-            results.append((node.word, current_row[-1]))
-
-        # if any entries in the row are less than the maximum cost, then 
-        # recursively search each branch of the trie
-        if min(current_row) <= max_cost:
-            for letter in node.children:
-                stack.append((node.children[letter], letter, word, current_row, results))
+        edge, states, depth = pop()
+        label = range(edge_label[edge], edge_label[edge + 1])
+        node = child_idx[edge]
+        node_word = word_id[node]
+        node_flags = word_flags[node]
+        node_min_length = min_length[node]
+        node_max_length = max_length[node]
+        child_depth = depth + len(label)
+
+        child_states = []
+        for i, vp, vn, score in states:
+            word_best = best[i]
+            best_cost = word_best[0]
+            word_length = word_lengths[i]
+            if (node_min_length - word_length >= best_cost
+                    or word_length - node_max_length >= best_cost):
+                continue
+            mask = masks[i]
+            last_row = last_rows[i]
+            letter_mask = letter_masks[i]
+            state_depth = depth
+
+            for pos in label:
+                eq = letter_mask(label_chars[pos], 0)
+                d0 = ((((eq & vp) + vp) ^ vp) | eq | vn) & mask
+                hp = vn | (~(vp | d0) & mask)
+                hn = vp & d0
+
+                hp = (hp << 1) | 1
+                hn = hn << 1
+                if hp & last_row:
+                    score += 1
+                elif hn & last_row:
+                    score -= 1
+
+                vn = hp & d0
+                vp = (hn | ~(hp | d0)) & mask
+                state_depth += 1
+
+                lower_bound = score - bit_count(vp)
+                first_bound = state_depth - bit_count(vn)
+                if first_bound > lower_bound:
+                    lower_bound = first_bound
+                if lower_bound >= best_cost:
+                    break
+            else:
+                if score < best_cost and node_flags & flag_masks[i]:
+                    best_cost = word_best[0] = score
+                    word_best[1] = node_word
+
+                if lower_bound < best_cost:
+                    child_states.append((i, vp, vn, score))
+
+        if child_states:
+            first = child_first[node]
+            for child_edge in range(first, first + child_count[node]):
+                push((child_edge, child_states, child_depth))
+
+if njit is not None:
+    _M1 = np.uint64(0x5555555555555555)
+    _M2 = np.uint64(0x3333333333333333)
+    _M4 = np.uint64(0x0f0f0f0f0f0f0f0f)
+    _H01 = np.uint64(0x0101010101010101)
+
+    @njit(cache=True)
+    def _popcount(x):
+        x = x - ((x >> np.uint64(1)) & _M1)
+        x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+        x = (x + (x >> np.uint64(4))) & _M4
+        return np.int64((x * _H01) >> np.uint64(56))
+
+    @njit(cache=True)
+    def _search_jit(child_first, child_count, edge_label, label_chars, child_idx, word_id,
+                    word_flags, min_length, max_length, word_codes, max_cost, flag_mask,
+                    stack_size):
+        """Compiled version of closest_stack(), run for all the branches of the root.
+        The word must have between 1 and 64 letters, given as code points in word_codes.
+        Returns a tuple (index in FlatTrie.words of the best match, its distance), the index
+        being -1 if no word is within max_cost.
+        """
+        word_length = word_codes.shape[0]
+        one = np.uint64(1)
+        if word_length == 64:
+            mask = ~np.uint64(0)
+        else:
+            mask = (one << np.uint64(word_length)) - one
+        last_row = one << np.uint64(word_length - 1)
+
+        # distinct letters of the word and their pattern masks
+        letters = np.empty(word_length, np.int64)
+        letter_masks = np.zeros(word_length, np.uint64)
+        n_letters = 0
+        for j in range(word_length):
+            k = 0
+            while k < n_letters and letters[k] != word_codes[j]:
+                k += 1
+            if k == n_letters:
+                letters[k] = word_codes[j]
+                n_letters += 1
+            letter_masks[k] |= one << np.uint64(j)
+
+        stack_edge = np.empty(stack_size, np.int64)
+        stack_vp = np.empty(stack_size, np.uint64)
+        stack_vn = np.empty(stack_size, np.uint64)
+        stack_score = np.empty(stack_size, np.int64)
+        stack_depth = np.empty(stack_size, np.int64)
+
+        best_idx = -1
+        best_cost = max_cost + 1
+
+        for root_edge in range(child_first[0], child_first[0] + child_count[0]):
+            stack_edge[0] = root_edge
+            stack_vp[0] = mask
+            stack_vn[0] = np.uint64(0)
+            stack_score[0] = word_length
+            stack_depth[0] = 0
+            top = 1
+
+            while top > 0:
+                top -= 1
+                edge = stack_edge[top]
+                vp = stack_vp[top]
+                vn = stack_vn[top]
+                score = stack_score[top]
+                depth = stack_depth[top]
+
+                node = child_idx[edge]
+                if (min_length[node] - word_length >= best_cost
+                        or word_length - max_length[node] >= best_cost):
+                    continue
+
+                lower_bound = 0
+                alive = True
+                for pos in range(edge_label[edge], edge_label[edge + 1]):
+                    letter = label_chars[pos]
+                    eq = np.uint64(0)
+                    for k in range(n_letters):
+                        if letters[k] == letter:
+                            eq = letter_masks[k]
+                            break
+
+                    d0 = ((((eq & vp) + vp) ^ vp) | eq | vn) & mask
+                    hp = vn | (~(vp | d0) & mask)
+                    hn = vp & d0
+                    if hp & last_row:
+                        score += 1
+                    elif hn & last_row:
+                        score -= 1
+                    hp = (hp << one) | one
+                    hn = hn << one
+                    vn = hp & d0
+                    vp = (hn | ~(hp | d0)) & mask
+                    depth += 1
+
+                    lower_bound = max(score - _popcount(vp), depth - _popcount(vn))
+                    if lower_bound >= best_cost:
+                        alive = False
+                        break
+                if not alive:
+                    continue
+
+                if score < best_cost and word_flags[node] & flag_mask:
+                    best_cost = score
+                    best_idx = word_id[node]
+                    if score == 0:
+                        return best_idx, best_cost
+
+                if lower_bound < best_cost:
+                    first = child_first[node]
+                    for child_edge in range(first, first + child_count[node]):
+                        stack_edge[top] = child_edge
+                        stack_vp[top] = vp
+                        stack_vn[top] = vn
+                        stack_score[top] = score
+                        stack_depth[top] = depth
+                        top += 1
+
+        return best_idx, best_cost
+
+    @njit(cache=True)
+    def _search_batch_jit(child_first, child_count, edge_label, label_chars, child_idx,
+                          word_id, word_flags, min_length, max_length, word_codes, word_lengths,
+                          max_costs, flag_masks, stack_size):
+        """Runs _search_jit for each row of word_codes, the k-th word being the first
+        word_lengths[k] code points of the k-th row. Returns two arrays with the index of the
+        best match and its distance for each word."""
+        n_words = word_lengths.shape[0]
+        best_idx = np.empty(n_words, np.int64)
+        best_cost = np.empty(n_words, np.int64)
+        for k in range(n_words):
+            idx, cost = _search_jit(child_first, child_count, edge_label, label_chars,
+                                    child_idx, word_id, word_flags, min_length, max_length,
+                                    word_codes[k, :word_lengths[k]], max_costs[k],
+                                    flag_masks[k], stack_size)
+            best_idx[k] = idx
+            best_cost[k] = cost
+        return best_idx, best_cost
+
+# Whether the searches were already compiled in this process, see _compile_searches()
+_searches_compiled = False
+
+def _compile_searches(trie):
+    """Compiles the single and the batched search, if numba is available, with a query of the
+    trie, so that the first real queries don't pay for it. Only the first call in a process
+    makes the queries."""
+    global _searches_compiled
+    if njit is None or _searches_compiled:
+        return
+    closest_match(trie, "a", 0)
+    closest_matches(trie, ["a"], [0])
+    _searches_compiled = True
 
 class AllGazetteer(object):
     def __init__(self, type_filepath_dict):
@@ -72,9 +643,13 @@ class AllGazetteer(object):
         self._entry_types = dict()
         self._entries_trie = TrieNode()
         self._tokens_trie = TrieNode()
+        # phrase -> its closest match in each trie, shared by all the queries
+        self._closest_entries = _InsertionOrderedDict()
+        self._closest_tokens = _InsertionOrderedDict()
 
         self.fill_gazetteer(type_filepath_dict)
-        
+        self._freeze()
+
     def fill_gazetteer(self, type_filepath_dict):
         """Fills the gazetteer from a list of entries provided in a 
         text file.  Each line in the file corresponds to an entity. 
@@ -93,74 +668,129 @@ class AllGazetteer(object):
 
                     if len(entries) > 0:
                         for idx, entry in enumerate(entries):
+                            # skips the empty entries of blank lines and of trailing commas
+                            if not entry:
+                                continue
                             # 1. Enter entry into trie and types
                             if not entry in self._entry_types:
-                                self._entry_types[entry] = []
+                                self._entry_types[entry] = set()
                                 self._entries_trie.insert(entry)
-                            self._entry_types[entry].append(e_type)
+                            self._entry_types[entry].add(e_type)
                             
                             #2. Enter tokens into type and trie
                             tokens = entry.split()
                             for idx, token in enumerate(tokens):
                                 if not token in self._token_types:
-                                    self._token_types[token] = []
+                                    self._token_types[token] = set()
                                     self._tokens_trie.insert(token)
-                                self._token_types[token].append(e_type)
+                                self._token_types[token].add(e_type)
         
         #This sorting will reduce the dimensionality of features later on.
-        for token, token_types in self._token_types.items():
-            token_types.sort()
-        for entry, entry_types in self._entry_types.items():
-            entry_types.sort()
+        #The types of each word are joined once into their feature value, which is shared by
+        #all the words of the same types.
+        joined_types = {}
+        for words_types in (self._token_types, self._entry_types):
+            for word, types in words_types.items():
+                types = tuple(sorted(types))
+                if types not in joined_types:
+                    joined_types[types] = "_".join(types)
+                words_types[word] = joined_types[types]
+
+    def _freeze(self):
+        """Replaces the tries, once filled, by their flattened read-only versions."""
+        self._entries_trie = FlatTrie(self._entries_trie)
+        self._tokens_trie = FlatTrie(self._tokens_trie)
+        _compile_searches(self._tokens_trie)
     
     def minimum_distance_to_token(self, phrase):
-        distance_percentage = 0.30
-        max_distance = max(1, int(len(phrase) * distance_percentage))
-        results = search(self._tokens_trie, phrase.lower(), max_distance)
-        
-        if len(results) > 0:
-            minimum_value = min(results, key = operator.itemgetter(1))[1]
-            return minimum_value / float(len(phrase))
-        else:
-            return 1.0
+        match = self._closest_match(self._tokens_trie, self._closest_tokens, phrase)
+        return _match_distance(phrase, match)
     
     def minimum_distance_to_entry(self, phrase):
-        distance_percentage = 0.30
-        max_distance = max(1, int(len(phrase) * distance_percentage))
-        results = search(self._entries_trie, phrase.lower(), max_distance)
-        
-        if len(results) > 0:
-            minimum_value = min(results, key = operator.itemgetter(1))[1]
-            return minimum_value / float(len(phrase))
-        else:
-            return 1.0
+        match = self._closest_match(self._entries_trie, self._closest_entries, phrase)
+        return _match_distance(phrase, match)
     
+    def minimum_distances_to_tokens(self, phrases):
+        '''
+        Batched minimum_distance_to_token(): returns a list with the minimum distance value of
+        each phrase, all the phrases not cached yet being searched in a single walk over the trie.
+        '''
+        matches = self._closest_matches(self._tokens_trie, self._closest_tokens, phrases)
+        return [_match_distance(phrase, match) for phrase, match in zip(phrases, matches)]
+
+    def minimum_distances_to_entries(self, phrases):
+        '''
+        Batched minimum_distance_to_entry(): returns a list with the minimum distance value of
+        each phrase, all the phrases not cached yet being searched in a single walk over the trie.
+        '''
+        matches = self._closest_matches(self._entries_trie, self._closest_entries, phrases)
+        return [_match_distance(phrase, match) for phrase, match in zip(phrases, matches)]
+
     def closest_entry_types(self, phrase):
-        distance_percentage = 0.30
-        max_distance = max(1, int(len(phrase) * distance_percentage))
-        results = search(self._entries_trie, phrase.lower(), max_distance)
-        
-        if len(results) > 0:
-            entry = min(results, key = operator.itemgetter(1))[0]
-            if entry in self._entry_types:
-                types = self._entry_types[entry]
-                return "_".join(types)
-        
-        return "NONE"
+        match = self._closest_match(self._entries_trie, self._closest_entries, phrase)
+        return self._types(self._entry_types, match)
     
     def closest_token_types(self, phrase):
-        distance_percentage = 0.30
-        max_distance = max(1, int(len(phrase) * distance_percentage))
-        results = search(self._tokens_trie, phrase.lower(), max_distance)
-
-        if len(results) > 0:
-            token = min(results, key = operator.itemgetter(1))[0]
-            if token in self._token_types:
-                types = self._token_types[token]
-                return "_".join(types)
-        
+        match = self._closest_match(self._tokens_trie, self._closest_tokens, phrase)
+        return self._types(self._token_types, match)
+
+    def closest_entry_types_batch(self, phrases):
+        '''
+        Batched closest_entry_types(): returns a list with the closest entry types of each
+        phrase, all the phrases not cached yet being searched in a single walk over the trie.
+        '''
+        matches = self._closest_matches(self._entries_trie, self._closest_entries, phrases)
+        return [self._types(self._entry_types, match) for match in matches]
+
+    def closest_token_types_batch(self, phrases):
+        '''
+        Batched closest_token_types(): returns a list with the closest token types of each
+        phrase, all the phrases not cached yet being searched in a single walk over the trie.
+        '''
+        matches = self._closest_matches(self._tokens_trie, self._closest_tokens, phrases)
+        return [self._types(self._token_types, match) for match in matches]
+
+    @staticmethod
+    def _types(words_types, match):
+        if match is not None:
+            word = match[0]
+            if word in words_types:
+                return words_types[word]
+
         return "NONE"
 
+    def _closest_match(self, trie, matches_cache, phrase):
+        """Returns the closest match (see closest_match()) of a phrase in a trie, cached in the
+        dict matches_cache. The distances and the types are both derived from it, so the
+        feature generators querying the same phrases share the searches."""
+        if phrase in matches_cache:
+            return matches_cache[phrase]
+        match = closest_match(trie, phrase.lower(), _max_distance(phrase))
+        _cache_set(matches_cache, phrase, match)
+        return match
+
+    def _closest_matches(self, trie, matches_cache, phrases):
+        """Batched _closest_match(): the phrases not cached yet are searched in a single walk
+        over the trie."""
+        matches = {}
+        missing = []
+        for phrase in phrases:
+            if phrase in matches:
+                continue
+            if phrase in matches_cache:
+                matches[phrase] = matches_cache[phrase]
+            else:
+                matches[phrase] = None
+                missing.append(phrase)
+
+        found = closest_matches(trie, [phrase.lower() for phrase in missing],
+                                [_max_distance(phrase) for phrase in missing])
+        for phrase, match in zip(missing, found):
+            matches[phrase] = match
+            _cache_set(matches_cache, phrase, match)
+
+        return [matches[phrase] for phrase in phrases]
+
 class Gazetteer(object):
     """Class encapsulating a Gazetteer.
     A Gazetteer contains a set of words that are names (e.g. names of people)."""
@@ -174,11 +804,17 @@ class Gazetteer(object):
         self.synonyms_to_official_name = dict()
         self.official_names_set = set()
         self.synonyms_set = set()
-        self.official_names_trie = TrieNode()
-        self.synonyms_trie = TrieNode()
+        # official names and synonyms, flagged as OFFICIAL_NAME and/or SYNONYM
+        self.names_trie = TrieNode()
         self.position_in_name = {}
         self.tokens_trie = TrieNode()
+        self._official_name_distances = _InsertionOrderedDict()
+        self._synonym_distances = _InsertionOrderedDict()
+        # phrase -> its closest match among the tokens and among the synonyms
+        self._closest_tokens = _InsertionOrderedDict()
+        self._closest_synonyms = _InsertionOrderedDict()
         self.fill_gazetteer(file_path)
+        self._freeze()
 
     def fill_gazetteer(self, file_path):
         """Fills the gazetteer from a list of entries provided in a 
@@ -191,25 +827,41 @@ class Gazetteer(object):
 
         with open(file_path) as f:
             for line in f:
-                lower_line = line.lower()
-                entries = lower_line.split(",")
-                entries = [a.strip() for a in entries]
-
-                if len(entries) > 0:
-                    self.official_names_set.add(entries[0])
-                    self.official_names_trie.insert(entries[0])
-                    self.synonyms_set.update(entries[0:])
-                    for entry in entries[0:]:
-                        self.synonyms_trie.insert(entry)
-                    
-                    for i in range(len(entries)):
-                        official_name = entries[0]
-                        entry = entries[i]
-                        self.synonyms_to_official_name[entry] = official_name
-                        tokens = entry.split()
-                        for it, token in enumerate(tokens):
-                            self.tokens_trie.insert(token)
-                            self.position_in_name[token] = it
+                entries = [a.strip() for a in line.lower().split(",")]
+                # skips blank lines and lines without an official name
+                if not entries[0]:
+                    continue
+
+                official_name = entries[0]
+                self.official_names_set.add(official_name)
+                self.names_trie.insert(official_name, OFFICIAL_NAME)
+
+                for entry in entries:
+                    if not entry:
+                        continue
+                    if entry not in self.synonyms_set:
+                        self.synonyms_set.add(entry)
+                        self.names_trie.insert(entry, SYNONYM)
+                    self.synonyms_to_official_name[entry] = official_name
+                    tokens = entry.split()
+                    for it, token in enumerate(tokens):
+                        self.tokens_trie.insert(token)
+                        self.position_in_name[token] = it
+
+    def _freeze(self):
+        """Replaces the tries, once filled, by their flattened read-only versions."""
+        self.names_trie = FlatTrie(self.names_trie)
+        self.tokens_trie = FlatTrie(self.tokens_trie)
+        # distinct lengths of the names, to skip the search of phrases too long or too short
+        self._official_name_lengths = sorted(set(len(name) for name in self.official_names_set))
+        self._synonym_lengths = sorted(set(len(name) for name in self.synonyms_set))
+        self._synonyms_automaton = None
+        if ahocorasick is not None and self.synonyms_set:
+            self._synonyms_automaton = ahocorasick.Automaton()
+            for synonym in self.synonyms_set:
+                self._synonyms_automaton.add_word(synonym, synonym)
+            self._synonyms_automaton.make_automaton()
+        _compile_searches(self.tokens_trie)
 
     def contains_as_official_name(self, phrase):
         """Returns whether the Gazetteer contains the entire phrase or not
@@ -227,53 +879,91 @@ class Gazetteer(object):
         as a synonym
         '''
         return phrase.lower() in self.synonyms_set
+
+    def iter_mentions(self, text):
+        '''
+        Yields all the occurrences of synonyms in the text, as tuples (start, end, synonym)
+        where text.lower()[start:end] == synonym, ordered by end. The occurrences may overlap
+        and are not required to start or end at word boundaries.
+        Uses an Aho-Corasick automaton if pyahocorasick is available.
+        '''
+        text = text.lower()
+        if self._synonyms_automaton is not None:
+            for last, synonym in self._synonyms_automaton.iter(text):
+                yield (last + 1 - len(synonym), last + 1, synonym)
+            return
+
+        if not self._synonym_lengths:
+            return
+        max_length = self._synonym_lengths[-1]
+        for end in range(1, len(text) + 1):
+            for start in range(max(0, end - max_length), end):
+                if text[start:end] in self.synonyms_set:
+                    yield (start, end, text[start:end])
     
     def minimum_distance_to_token(self, phrase):
-        distance_percentage = 0.30
-        max_distance = max(1, int(len(phrase) * distance_percentage))
-        results = search(self.tokens_trie, phrase.lower(), max_distance)
-
-        if len(results) > 0:
-            minimum_value = min(results, key = operator.itemgetter(1))[1]
-            return minimum_value / float(len(phrase))
-        else:
-            return 1.0
+        '''
+        Returns the minimum Levenshtein distance value from the phrase to any token of the
+        names. The closest token is cached per phrase, and shared with closest_token().
+        '''
+        return _match_distance(phrase, self._closest_token_match(phrase))
     
     def minimum_distance_to_official_name(self, phrase):
         '''
         Returns the minimum Levenshtein distance value from the phrase to 
         any entry in the official_names_list.
+        The results are cached per phrase.
         '''
-        distance_percentage = 0.30
-        max_distance = max(1, int(len(phrase) * distance_percentage))
-        results = search(self.official_names_trie, phrase.lower(), max_distance)
+        distance = self._official_name_distances.get(phrase)
+        if distance is None:
+            distance = self._minimum_distance_to_official_name(phrase)
+            _cache_set(self._official_name_distances, phrase, distance)
+        return distance
 
-        if len(results) > 0:
-            minimum_value = min(results, key = operator.itemgetter(1))[1]
-            return minimum_value / float(len(phrase))
-        else:
+    def _minimum_distance_to_official_name(self, phrase):
+        lower_phrase = phrase.lower()
+        if lower_phrase in self.official_names_set:
+            return 0.0
+        max_distance = _max_distance(phrase)
+        if not _length_within(self._official_name_lengths, len(lower_phrase), max_distance):
             return 1.0
+        match = closest_match(self.names_trie, lower_phrase, max_distance, OFFICIAL_NAME)
+        return _match_distance(phrase, match)
     
     def closest_official_name(self, phrase):
-        distance_percentage = 0.30
-        max_distance = max(1, int(len(phrase) * distance_percentage))
-        results = search(self.synonyms_trie, phrase.lower(), max_distance)
-        if len(results) > 0:
-            entry = min(results, key = operator.itemgetter(1))[0]
+        '''
+        Returns the official name of the closest synonym of the phrase, or "NONE".
+        The closest synonym is cached per phrase.
+        '''
+        match = self._closest_synonym_match(phrase)
+        if match is not None:
+            entry = match[0]
             return self.synonyms_to_official_name[entry]
         else:
             return "NONE"
 
     def closest_token(self, phrase):
-        distance_percentage = 0.30
-        max_distance = max(1, int(len(phrase) * distance_percentage))
-        results = search(self.tokens_trie, phrase.lower(), max_distance)
+        match = self._closest_token_match(phrase)
 
-        if len(results) > 0:
-            entry = min(results, key = operator.itemgetter(1))[0]
+        if match is not None:
+            entry = match[0]
             return entry
         else:
             "None"
+
+    def _closest_token_match(self, phrase):
+        if phrase in self._closest_tokens:
+            return self._closest_tokens[phrase]
+        match = closest_match(self.tokens_trie, phrase.lower(), _max_distance(phrase))
+        _cache_set(self._closest_tokens, phrase, match)
+        return match
+
+    def _closest_synonym_match(self, phrase):
+        if phrase in self._closest_synonyms:
+            return self._closest_synonyms[phrase]
+        match = closest_match(self.names_trie, phrase.lower(), _max_distance(phrase), SYNONYM)
+        _cache_set(self._closest_synonyms, phrase, match)
+        return match
     
     def token_position_in_name(self, token):
         if token in self.position_in_name:
@@ -284,12 +974,106 @@ class Gazetteer(object):
         '''
         Returns the minimum Levenshtein distance value from the phrase to
         any entry in the synonym name list.
+        The results are cached per phrase.
         '''
-        distance_percentage = 0.30
-        max_distance = max(1, int(len(phrase) * distance_percentage))
-        results = search(self.synonyms_trie, phrase.lower(), max_distance)
-        if len(results) > 0:
-            minimum_distance = min(results, key = operator.itemgetter(1))[1]
-            return minimum_distance / float(len(phrase))
-        else:
-            return 1.0
\ No newline at end of file
+        distance = self._synonym_distances.get(phrase)
+        if distance is None:
+            distance = self._minimum_distance_to_synonym(phrase)
+            _cache_set(self._synonym_distances, phrase, distance)
+        return distance
+
+    def _minimum_distance_to_synonym(self, phrase):
+        lower_phrase = phrase.lower()
+        if lower_phrase in self.synonyms_set:
+            return 0.0
+        if not _length_within(self._synonym_lengths, len(lower_phrase), _max_distance(phrase)):
+            return 1.0
+        # the same search as closest_official_name()
+        return _match_distance(phrase, self._closest_synonym_match(phrase))
+
+    def min_distances(self, phrases):
+        '''
+        Batched minimum_distance_to_synonym(): returns a list with the minimum Levenshtein
+        distance value from each phrase to any entry in the synonym name list.
+        All the phrases that are not cached yet are searched in a single walk over the trie.
+        '''
+        distances = {}
+        missing = []
+        for phrase in phrases:
+            if phrase in distances:
+                continue
+            distance = self._synonym_distances.get(phrase)
+            if distance is None:
+                # the exact matches and the phrases too long or too short need no search
+                lower_phrase = phrase.lower()
+                if lower_phrase in self.synonyms_set:
+                    distance = 0.0
+                elif not _length_within(self._synonym_lengths, len(lower_phrase),
+                                        _max_distance(phrase)):
+                    distance = 1.0
+                elif phrase in self._closest_synonyms:
+                    # already searched by closest_official_name()
+                    distance = _match_distance(phrase, self._closest_synonyms[phrase])
+                else:
+                    missing.append(phrase)
+            distances[phrase] = distance
+
+        matches = closest_matches(self.names_trie, [phrase.lower() for phrase in missing],
+                                  [_max_distance(phrase) for phrase in missing],
+                                  [SYNONYM] * len(missing))
+        for phrase, match in zip(missing, matches):
+            distance = _match_distance(phrase, match)
+            distances[phrase] = distance
+            _cache_set(self._synonym_distances, phrase, distance)
+            _cache_set(self._closest_synonyms, phrase, match)
+
+        return [distances[phrase] for phrase in phrases]
+
+def load_all_gazetteer(type_filepath_dict, cache=True):
+    """Builds the AllGazetteer of the gazetteer files of all types.
+    With cache, the frozen AllGazetteer is pickled next to the file of the first type (in the
+    order of the types), to that file + GAZETTEER_CACHE_SUFFIX, after its key: the
+    GAZETTEER_CACHE_VERSION and the type, file and modification time of each file. It is
+    loaded from there instead of being built again as long as the key did not change.
+    Args:
+        type_filepath_dict: Dict mapping each gazetteer type to the file to fill it from.
+        cache: Whether to use the pickled cache of the gazetteer. (Default is True.)
+    Returns:
+        The AllGazetteer.
+    """
+    if not cache or not type_filepath_dict:
+        return AllGazetteer(type_filepath_dict)
+
+    items = sorted(type_filepath_dict.items())
+    cache_key = [GAZETTEER_CACHE_VERSION] + [(gaz_type, gaz_filepath,
+                                              os.path.getmtime(gaz_filepath))
+                                             for gaz_type, gaz_filepath in items]
+    cache_filepath = items[0][1] + GAZETTEER_CACHE_SUFFIX
+
+    allgazetteer = None
+    try:
+        with open(cache_filepath, "rb") as f:
+            if pickle.load(f) == cache_key:
+                allgazetteer = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        # no cache yet, or an unreadable one (e.g. truncated, or of classes since renamed): it
+        # is written again below
+        pass
+    if allgazetteer is not None:
+        # it was frozen in another process, the searches still have to be compiled in this one
+        _compile_searches(allgazetteer._tokens_trie)
+        return allgazetteer
+
+    allgazetteer = AllGazetteer(type_filepath_dict)
+    # written to a temporary file first, not to leave a truncated cache behind
+    tmp_filepath = "{}.{}.tmp".format(cache_filepath, os.getpid())
+    try:
+        with open(tmp_filepath, "wb") as f:
+            pickle.dump(cache_key, f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(allgazetteer, f, pickle.HIGHEST_PROTOCOL)
+        _replace(tmp_filepath, cache_filepath)
+    except (IOError, OSError):
+        # e.g. a read-only directory: the gazetteer is just built again next time
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+    return allgazetteer
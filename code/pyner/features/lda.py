@@ -36,7 +36,7 @@ class LdaWrapper(object):
         else:
             _hash = str(hash(text))
 
-            if self.cache.has_key(_hash):
+            if _hash in self.cache:
                 return self.cache[_hash]
             else:
                 topics = self.get_topics_uncached(text)
@@ -47,6 +47,36 @@ class LdaWrapper(object):
 
                 return topics
 
+    def get_topics_many(self, texts):
+        """Returns the topics of several small string text windows, like get_topics() does for
+        one. All the texts not found in the cache are inferred by a single call to the LDA.
+        Args:
+            texts: List of small text windows as strings.
+        Returns:
+            List with, for each text, a list of tuples of form (topic index, probability).
+        """
+        results = [None] * len(texts)
+        uncached = []
+        for idx, text in enumerate(texts):
+            if self.cache is not None:
+                _hash = str(hash(text))
+                if _hash in self.cache:
+                    results[idx] = self.cache[_hash]
+                    continue
+            uncached.append(idx)
+
+        topics_lists = self.get_topics_many_uncached([texts[idx] for idx in uncached])
+        for idx, topics in zip(uncached, topics_lists):
+            results[idx] = topics
+            if self.cache is not None:
+                self.cache[str(hash(texts[idx]))] = topics
+
+        if uncached and self.cache is not None:
+            if random.randint(1, 100) <= self.cache_synch_prob:
+                self.synchronize_cache()
+
+        return results
+
     def get_topics_uncached(self, text):
         """Returns the topics of a small string text window without querying the cache.
         Args:
@@ -54,8 +84,29 @@ class LdaWrapper(object):
         Returns:
             List of tuples of form (topic index, probability).
         """
-        tokens = text.lower().split(" ")
-        return self.lda[self.dictionary.doc2bow(tokens)]
+        # not self.lda[bow], which also collects the sufficient statistics in older gensim
+        return self.get_topics_many_uncached([text])[0]
+
+    def get_topics_many_uncached(self, texts):
+        """Returns the topics of several small string text windows without querying the cache.
+        Args:
+            texts: List of small text windows as strings.
+        Returns:
+            List with, for each text, a list of tuples of form (topic index, probability).
+        """
+        if not texts:
+            return []
+        bows = [self.dictionary.doc2bow(text.lower().split(" ")) for text in texts]
+        # the documents are inferred as one chunk, then each distribution is normalized and
+        # filtered like self.lda[bow] does for a single document
+        gammas, _ = self.lda.inference(bows, collect_sstats=False)
+        minimum_probability = max(self.lda.minimum_probability, 1e-8)
+        topics_lists = []
+        for gamma in gammas:
+            topic_dist = gamma / sum(gamma)
+            topics_lists.append([(topic_idx, prob) for topic_idx, prob in enumerate(topic_dist)
+                                 if prob >= minimum_probability])
+        return topics_lists
 
     def synchronize_cache(self):
         """Synchronizes the shelve cache on the HDD with the version in the RAM."""
@@ -37,7 +37,7 @@ class PosTagger(object):
         else:
             text = " ".join(tokens)
             _hash = str(hash(text))
-            if self.cache.has_key(_hash):
+            if _hash in self.cache:
                 return self.cache[_hash]
             else:
                 tagged = self.tag_uncached(tokens)
@@ -48,6 +48,37 @@ class PosTagger(object):
 
                 return tagged
 
+    def tag_many(self, token_lists):
+        """Annotate several lists of strings with their POS tags, like tag() does for one list.
+        The lists are tagged independently from each other, but all the lists not found in the
+        cache are passed to the tagger in a single call.
+        Args:
+            token_lists: List of lists of strings.
+        Returns:
+            List of lists of tuples with the token and the tag (POS tags)
+        """
+        results = [None] * len(token_lists)
+        uncached = []
+        for idx, tokens in enumerate(token_lists):
+            if self.cache is not None:
+                _hash = str(hash(" ".join(tokens)))
+                if _hash in self.cache:
+                    results[idx] = self.cache[_hash]
+                    continue
+            uncached.append(idx)
+
+        tagged_lists = self.tag_many_uncached([token_lists[idx] for idx in uncached])
+        for idx, tagged in zip(uncached, tagged_lists):
+            results[idx] = tagged
+            if self.cache is not None:
+                self.cache[str(hash(" ".join(token_lists[idx])))] = tagged
+
+        if uncached and self.cache is not None:
+            if random.randint(1, 100) <= self.cache_synch_prob:
+                self.synchronize_cache()
+
+        return results
+
     def tag_uncached(self, tokens):
         """Annotate a list of strings with their POS tags without querying the cache.
         Args:
@@ -55,6 +86,26 @@ class PosTagger(object):
         Returns:
             List of tuples with the token and the tag (POS tags)
         """
+        self.check_length(tokens)
+        return self.tagger.tag(tokens)
+
+    def tag_many_uncached(self, token_lists):
+        """Annotate several lists of strings with their POS tags without querying the cache.
+        Args:
+            token_lists: List of lists of strings.
+        Returns:
+            List of lists of tuples with the token and the tag (POS tags)
+        """
+        for tokens in token_lists:
+            self.check_length(tokens)
+        return self.tagger.tag_sents(token_lists)
+
+    def check_length(self, tokens):
+        """Raises an exception if the string of a list of tokens is too long or too short to be
+        POS-tagged.
+        Args:
+            tokens: List of strings.
+        """
         # length of each word + count of required whitespaces between each word
         # max() to avoid -1 if the list of tokens in empty
         total_length = sum([len(token) for token in tokens]) + (max(len(tokens) - 1, 0))
@@ -65,8 +116,6 @@ class PosTagger(object):
             raise Exception("String to POS-tag is too short (%d vs min "\
                             "%d)." % (total_length, self.min_string_length))
         
-        return self.tagger.tag(tokens)
-        
     def synchronize_cache(self):
         """Synchronizes the shelve cache on the HDD with the version in the RAM."""
         self.cache.sync()
\ No newline at end of file
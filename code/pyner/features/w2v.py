@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Encapsulates handling of a word2vec clusters file."""
 from __future__ import absolute_import, division, print_function, unicode_literals
+import io
 
 class W2VClusters(object):
     """Encapsulates handling of a word2vec clusters file.
@@ -30,13 +31,17 @@ class W2VClusters(object):
         Args:
             filepath: Filepath to the word2vec clusters file.
         """
-        with open(filepath, "r") as handle:
+        # cluster index -> the first int read for it, so that all the words of a cluster share
+        # one int object instead of keeping a copy each
+        cluster_indices = dict()
+        with io.open(filepath, "r", encoding="utf-8") as handle:
             for line_idx, line in enumerate(handle):
-                columns = line.decode("utf-8").strip().split(" ")
+                columns = line.strip().split(" ")
                 if len(columns) == 2:
                     word = columns[0]
                     cluster_idx = int(columns[1])
-                    self.word_to_cluster[word] = cluster_idx
+                    self.word_to_cluster[word] = cluster_indices.setdefault(cluster_idx,
+                                                                            cluster_idx)
                 else:
                     print("[Warning] Expected 2 columns in w2v clusters file at line %d, " \
                           "got %d" % (line_idx, len(columns)))
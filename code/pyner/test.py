@@ -2,15 +2,17 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import argparse
 import random
 import pycrfsuite
-from itertools import chain
-from sklearn.metrics import classification_report
-from sklearn.preprocessing import LabelBinarizer
 import sys
 import json
 
-from pyner.datasets import load_windows, load_articles, generate_examples, Article, Window
+from pyner.datasets import load_windows, load_articles, generate_examples, apply_features_to_windows, \
+    Article, Window
 import pyner.features.features as features
-from pyner.features.gazetteer import Gazetteer
+
+try:
+    input = raw_input
+except NameError:
+    pass
 
 random.seed(42)
 
@@ -36,38 +38,33 @@ def tag_sentence_factory(conf):
                                     verbose = True, lda_window_left_size = 5,
                                     lda_window_right_size = 5)
 
+    def tag_sentences(sentence_texts):
+        """Tags several sentences, whose windows get their features in a single batch.
+        Args:
+            sentence_texts: List of the texts of the sentences.
+        Returns:
+            List of the tagged sequences, one per sentence.
+        """
+        windows = [Window(Article(sentence_text.lower()).tokens)
+                   for sentence_text in sentence_texts]
+        apply_features_to_windows(windows, feature_generators)
 
-    gaz_d = {}
-    for gaz_type, gaz_filepath in gaz_filepaths.items():
-        gaz = Gazetteer(gaz_filepath, type = gaz_type)
-        gaz_d[gaz_type] = gaz 
-
-    def tag_sentence(sentence_text):
-        sentence_text = sentence_text.lower()
-        article = Article(sentence_text)
-        window = Window(article.tokens)
-        window.apply_features(feature_generators)
-
-        feature_values_lists = []
-        for word_idx in range(len(window.tokens)):
-            fvl = window.get_feature_values_list(word_idx, skip_chain_left, skip_chain_right)
-            feature_values_lists.append(fvl)
-        tagged_sequence = tagger.tag(feature_values_lists)
-        return tagged_sequence
+        return [tagger.tag(window.get_feature_values_lists(skip_chain_left, skip_chain_right))
+                for window in windows]
 
-    return tag_sentence
+    return tag_sentences
 
 def main():
     with open(sys.argv[1]) as f:
         conf = json.load(f)
     
-    tag_sentence = tag_sentence_factory(conf)
+    tag_sentences = tag_sentence_factory(conf)
 
     while True:
-        query_text = raw_input("Your text: ")
+        query_text = input("Your text: ")
         if query_text == "exit":
             break
-        tagged_sequence = tag_sentence(query_text)
+        tagged_sequence = tag_sentences([query_text])[0]
         print("Tagged: {}".format(tagged_sequence))
 
 if __name__ == "__main__":
@@ -8,15 +8,221 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 import random
 import sys
 import json
+import gzip
+import hashlib
 import itertools
+import os
+import pickle
+from collections import deque
+import multiprocessing
+from multiprocessing import Pool
 import pycrfsuite
 
 import pyner.datasets
-from pyner.datasets import load_windows, load_articles, generate_examples
+from pyner.datasets import load_windows, load_articles, generate_examples, \
+    apply_features_to_windows, apply_features_in_batches
 import pyner.features.features as features
 
 random.seed(42)
 
+# The feature generators of a worker process of generate_examples_parallel()
+_worker_feature_generators = None
+
+def _init_worker(features_args, features_kwargs):
+    """Creates the feature generators of a worker process, once for all its windows."""
+    global _worker_feature_generators
+    _worker_feature_generators = features.create_features(*features_args, **features_kwargs)
+
+def _workers_are_forked():
+    """Returns whether the worker processes of a Pool are forked from this one."""
+    # multiprocessing.get_start_method is new in Python 3.4, before it always forked on POSIX
+    get_start_method = getattr(multiprocessing, "get_start_method", None)
+    if get_start_method is None:
+        return os.name == "posix"
+    return get_start_method() == "fork"
+
+def _featurize_windows(args):
+    """Applies the feature generators of the worker process to a batch of windows and returns
+    their (features, labels) pairs, see generate_examples()."""
+    windows, skip_chain_left, skip_chain_right = args
+    apply_features_to_windows(windows, _worker_feature_generators)
+    return [(window.get_feature_values_lists(skip_chain_left, skip_chain_right),
+             window.get_labels()) for window in windows]
+
+def generate_examples_parallel(windows, n_jobs, features_args, features_kwargs,
+                               skip_chain_left, skip_chain_right, nb_append=None, nb_skip=0,
+                               batch_size=100, verbose=True):
+    """Parallel generate_examples(): the windows get their features in n_jobs worker processes.
+    The feature generators are created with
+    features.create_features(*features_args, **features_kwargs): once, before starting the
+    workers, if they are forked (they then share the memory of the gazetteer tries with this
+    process, until it is written to), otherwise by each worker. The workers get batches of
+    batch_size windows. The examples are generated in the order of the windows, and only a few
+    batches per worker are in flight at any time.
+    Args:
+        windows: The windows to generate features and labels from, without features, see
+            load_windows().
+        n_jobs: Number of worker processes.
+        features_args: Positional arguments of features.create_features().
+        features_kwargs: Keyword arguments of features.create_features().
+        nb_append: How many windows to append max or None if unlimited. (Default is None.)
+        nb_skip: How many windows to skip at the start. (Default is 0.)
+        batch_size: How many windows to send to a worker at once. (Default is 100.)
+        verbose: Whether to print status messages. (Default is True.)
+    Returns:
+        Pairs of (features, labels), see generate_examples().
+    """
+    # the skipped windows don't even get their features
+    windows = itertools.islice(windows, nb_skip,
+                               None if nb_append is None else nb_skip + nb_append)
+    batches = iter(lambda: list(itertools.islice(windows, batch_size)), [])
+
+    global _worker_feature_generators
+    if _workers_are_forked():
+        _worker_feature_generators = features.create_features(*features_args,
+                                                              **features_kwargs)
+        pool = Pool(n_jobs)
+    else:
+        pool = Pool(n_jobs, _init_worker, (features_args, features_kwargs))
+    try:
+        pending = deque()
+        added = 0
+        while True:
+            # keeps every worker busy, without queueing up all the windows
+            for batch in itertools.islice(batches, 2 * n_jobs - len(pending)):
+                pending.append(pool.apply_async(_featurize_windows,
+                                                ((batch, skip_chain_left, skip_chain_right),)))
+            if not pending:
+                break
+
+            for example in pending.popleft().get():
+                yield example
+
+                # print message every nth window
+                added += 1
+                if verbose and added % 200 == 0:
+                    if nb_append is None:
+                        print("Generated %d examples" % (added))
+                    else:
+                        print("Generated %d of max %d examples" % (added, nb_append))
+                        sys.stdout.flush()
+    finally:
+        pool.terminate()
+        pool.join()
+        _worker_feature_generators = None
+
+# os.replace is new in Python 3.3
+_replace = getattr(os, "replace", os.rename)
+
+# Version of the cached examples, part of their cache key, to increase whenever the feature
+# generators or the examples generated from the windows change: the caches of another version
+# are generated again
+EXAMPLES_CACHE_VERSION = 1
+
+# Keys of the training config that don't change the examples, left out of their cache key
+_TRAINING_ONLY_KEYS = ('model_output_path', 'max_iterations', 'n_jobs',
+                       'examples_cache_filepath', 'deduplicate_examples', 'trainer_params',
+                       'sweep_trainer_params')
+
+def _examples_cache_key(conf):
+    """Returns the key of the examples generated with a training config: the
+    EXAMPLES_CACHE_VERSION, the config (without the keys that only matter for the training) and
+    the modification times of all the files it names, as a JSON string."""
+    example_conf = dict((key, value) for key, value in conf.items()
+                        if key not in _TRAINING_ONLY_KEYS)
+    filepaths = list((conf.get('gaz_filepaths') or {}).values()) + [
+        conf.get(key) for key in ('articles_filepath', 'brown_clusters_filepath',
+                                  'w2v_clusters_filepath', 'lda_model_filepath',
+                                  'lda_dictionary_filepath')]
+    mtimes = dict((filepath, os.path.getmtime(filepath)) for filepath in filepaths
+                  if filepath is not None and os.path.exists(filepath))
+    return json.dumps([EXAMPLES_CACHE_VERSION, example_conf, mtimes], sort_keys = True)
+
+def load_cached_examples(cache_filepath, cache_key):
+    """Loads the examples cached by cache_examples(), if they were cached with the same key.
+    Args:
+        cache_filepath: The filepath of the cache.
+        cache_key: The key of the examples, see _examples_cache_key().
+    Returns:
+        Generator of the cached (features, labels) pairs, see generate_examples(),
+        or None if there is no cache for this key.
+    """
+    try:
+        with gzip.open(cache_filepath, "rb") as handle:
+            if pickle.load(handle) != cache_key:
+                return None
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        # no cache yet, or an unreadable one
+        return None
+    return _iter_cached_examples(cache_filepath, cache_key)
+
+def _iter_cached_examples(cache_filepath, cache_key):
+    """Generator of the examples of load_cached_examples(). The cache is only opened once they
+    are iterated over, and closed with the generator."""
+    with gzip.open(cache_filepath, "rb") as handle:
+        if pickle.load(handle) != cache_key:
+            raise Exception("The examples cache %s was replaced while loading it" %
+                            (cache_filepath))
+        while True:
+            try:
+                yield pickle.load(handle)
+            except EOFError:
+                break
+
+def cache_examples(examples, cache_filepath, cache_key):
+    """Caches examples on the disk while passing them on, for load_cached_examples().
+    The examples are pickled one by one, after the key, to a gzip file. The cache is only
+    complete, and moved to cache_filepath, once all the examples have been passed on.
+    Args:
+        examples: The (features, labels) pairs to cache, see generate_examples().
+        cache_filepath: The filepath of the cache.
+        cache_key: The key of the examples, see _examples_cache_key().
+    Returns:
+        Generator of the examples.
+    """
+    tmp_filepath = "{}.{}.tmp".format(cache_filepath, os.getpid())
+    try:
+        with gzip.open(tmp_filepath, "wb") as handle:
+            pickle.dump(cache_key, handle, pickle.HIGHEST_PROTOCOL)
+            for example in examples:
+                pickle.dump(example, handle, pickle.HIGHEST_PROTOCOL)
+                yield example
+    except BaseException:
+        # an interrupted or failed run (or a consumer stopping early) leaves no partial cache
+        if os.path.exists(tmp_filepath):
+            os.remove(tmp_filepath)
+        raise
+    _replace(tmp_filepath, cache_filepath)
+
+def deduplicate_examples(examples, verbose=True):
+    """Passes on examples, skipping the ones identical (in features and labels) to an earlier
+    one, e.g. the windows of boilerplate text repeated across articles.
+    Only an 8-byte SHA-1 digest of each example is remembered. Two distinct examples among n
+    share one with a probability of about n * n / 2 ** 65 (3e-8 for a million examples), the
+    second one then being skipped too.
+    Args:
+        examples: The (features, labels) pairs, see generate_examples().
+        verbose: Whether to print how many examples were skipped. (Default is True.)
+    Returns:
+        Generator of the distinct examples.
+    """
+    seen = set()
+    skipped = 0
+    for feature_values_lists, labels in examples:
+        # the features and labels contain no whitespace other than spaces: the features of each
+        # token end with a tab, and the features and labels are separated by newlines
+        example_text = "".join("\n".join(feature_values) + "\t"
+                               for feature_values in feature_values_lists) + "\n".join(labels)
+        example_digest = hashlib.sha1(example_text.encode("utf-8")).digest()[:8]
+        if example_digest in seen:
+            skipped += 1
+        else:
+            seen.add(example_digest)
+            yield (feature_values_lists, labels)
+
+    if verbose:
+        print("Skipped %d duplicate examples" % (skipped))
+
 def main():
     '''
     Main function that reads parameter and starts the training process
@@ -24,8 +230,32 @@ def main():
     with open(sys.argv[1]) as f:
         conf = json.load(f)
     
-    train(conf)
-    
+    if conf.get('sweep_trainer_params'):
+        sweep(conf, conf['sweep_trainer_params'])
+    else:
+        train(conf)
+
+def sweep(conf, trainer_params_list):
+    """Trains one model per set of trainer parameters, e.g. to tune c1 and c2, with the
+    examples generated only once: the first training caches them (to the config's
+    examples_cache_filepath, or else next to the models) and the others load them from there.
+    The i-th model is saved to the config's model_output_path + ".<i>".
+    Args:
+        conf: The training config, see train().
+        trainer_params_list: List of dicts of trainer parameters, see the config's
+            trainer_params in train().
+    """
+    model_output_path = conf['model_output_path']
+    examples_cache_filepath = conf.get('examples_cache_filepath') or \
+        model_output_path + ".examples.pkl.gz"
+    for idx, trainer_params in enumerate(trainer_params_list):
+        print("Training model %d of %d with %s... " % (idx + 1, len(trainer_params_list),
+                                                      trainer_params))
+        run_conf = dict(conf, model_output_path = "%s.%d" % (model_output_path, idx),
+                        examples_cache_filepath = examples_cache_filepath,
+                        trainer_params = trainer_params)
+        train(run_conf)
+
 def train(conf):
     gaz_filepaths = conf.get('gaz_filepaths', None)
     brown_clusters_filepath = conf.get('brown_clusters_filepath', None)
@@ -43,6 +273,12 @@ def train(conf):
     max_iterations = conf.get('max_iterations', None)
     features_to_extract = conf.get('features_to_extract', None)
     ner_tags = conf.get('ner_tags', None)
+    n_jobs = conf.get('n_jobs', 1)
+    examples_cache_filepath = conf.get('examples_cache_filepath', None)
+    deduplicate = conf.get('deduplicate_examples', False)
+    only_labeled_windows = conf.get('only_labeled_windows', False)
+    # parameters of the trainer (e.g. c1, c2), override the defaults set with max_iterations
+    trainer_params = conf.get('trainer_params', None)
     
     if ner_tags is not None:
         pyner.datasets.ner_tags = ner_tags
@@ -50,24 +286,55 @@ def train(conf):
     print("Creating trainer... ")
     trainer = pycrfsuite.Trainer(verbose = True)
 
-    print("Creating features... ")
-    feature_generators = features.create_features(gaz_filepaths, brown_clusters_filepath,
-                                    w2v_clusters_filepath, lda_model_filepath, 
-                                    lda_dictionary_filepath, lda_cache_filepath, 
-                                    verbose = True, lda_window_left_size = 5,
-                                    lda_window_right_size = 5, 
-                                    features_to_extract = features_to_extract)
+    examples = None
+    if examples_cache_filepath is not None:
+        examples_cache_key = _examples_cache_key(conf)
+        examples = load_cached_examples(examples_cache_filepath, examples_cache_key)
+        if examples is not None:
+            print("Loading cached example windows... ")
+
+    if examples is None:
+        features_args = (gaz_filepaths, brown_clusters_filepath, w2v_clusters_filepath,
+                         lda_model_filepath, lda_dictionary_filepath, lda_cache_filepath)
+        features_kwargs = dict(verbose = True, lda_window_left_size = 5,
+                               lda_window_right_size = 5,
+                               features_to_extract = features_to_extract)
+
+        if n_jobs > 1:
+            # the feature generators are created by generate_examples_parallel(); without the
+            # LDA cache, since several processes can't write to the same shelve
+            features_args = features_args[:-1] + (None,)
+            features_kwargs['verbose'] = False
+        else:
+            print("Creating features... ")
+            feature_generators = features.create_features(*features_args, **features_kwargs)
+
+        print("Loading articles... ")
+        articles = load_articles(articles_filepath)
 
-    print("Loading articles... ")
-    articles = load_articles(articles_filepath)
+        print("Loading windows... ")
+        # the windows without labels are left out before they get any features
+        windows = load_windows(articles, window_size,
+                               only_labeled_windows = only_labeled_windows)
 
-    print("Loading windows... ")
-    windows = load_windows(articles, window_size,
-                            feature_generators, only_labeled_windows = False)
+        print("Adding example windows (up to max %d)..." % (count_windows_train))
+        if n_jobs > 1:
+            examples = generate_examples_parallel(windows, n_jobs, features_args, features_kwargs,
+                                                  skip_chain_left, skip_chain_right,
+                                                  nb_append = count_windows_train,
+                                                  nb_skip = count_windows_test, verbose = True)
+        else:
+            # the windows are skipped before they get their features
+            windows = itertools.islice(windows, count_windows_test,
+                                       count_windows_test + count_windows_train)
+            windows = apply_features_in_batches(windows, feature_generators)
+            examples = generate_examples(windows, skip_chain_left, skip_chain_right, nb_append = count_windows_train,
+                                            verbose = True)
+        if examples_cache_filepath is not None:
+            examples = cache_examples(examples, examples_cache_filepath, examples_cache_key)
 
-    print("Adding example windows (up to max %d)..." % (count_windows_train))
-    examples = generate_examples(windows, skip_chain_left, skip_chain_right, nb_append = count_windows_train,
-                                    nb_skip = count_windows_test, verbose = True)
+    if deduplicate:
+        examples = deduplicate_examples(examples)
 
     counter = 0
     
@@ -76,13 +343,18 @@ def train(conf):
         trainer.append(feature_values_lists, labels, group = counter % 10)
 
     print("Training... ")
+    params = {}
     if max_iterations is not None and max_iterations > 0:
-        trainer.set_params({'max_iterations': max_iterations,
-                            'c1': 1.0,
-                            'c2': 1.0,
-                            'feature.minfreq': 1,
-                            'feature.possible_states': True,
-                            'feature.possible_transitions': False })
+        params.update({'max_iterations': max_iterations,
+                       'c1': 1.0,
+                       'c2': 1.0,
+                       'feature.minfreq': 1,
+                       'feature.possible_states': True,
+                       'feature.possible_transitions': False })
+    if trainer_params is not None:
+        params.update(trainer_params)
+    if params:
+        trainer.set_params(params)
     trainer.train(model_output_path, holdout = 1)                  
 
 if __name__ == "__main__":